@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark: every service driven in-process through Flask test clients
+
+Generates a synthetic HyperK-style dataset of the requested size (CSV,
+converted to .npz with the repo's converter, plus a small image tree for
+the loader), then times /load, /augment, /quick_test and /evaluate and
+prints per-stage throughput, latency percentiles and peak RSS as JSON.
+Pass --baseline with an earlier report to flag regressions.
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SERVICES_DIR = os.path.join(ROOT, 'services')
+sys.path.insert(0, SERVICES_DIR)
+
+# Matches the HyperK sample: 20 features, classes 0-4, stored as 0, 4, ..., 16
+N_FEATURES = 20
+N_CLASSES = 5
+LABEL_SCALE = 4
+
+# Loader class/split layout, see services/data_loader/app.py
+IMAGE_CLASSES = ("normal", "dyed-lifted-polyps")
+IMAGE_SPLITS = ("train", "test")
+
+# Seconds between RSS samples while a stage runs
+RSS_INTERVAL = 0.01
+
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No procfs (macOS): the lifetime peak is the best there is
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class RssSampler:
+    """Track peak RSS on a background thread while a stage runs"""
+
+    def __init__(self, interval=RSS_INTERVAL):
+        self.interval = interval
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, rss_bytes())
+
+    def __enter__(self):
+        self.start_bytes = self.peak_bytes = rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, rss_bytes())
+
+
+def make_datasets(workdir, samples, test_samples, images, seed=0):
+    """
+    Write the benchmark inputs under workdir
+
+    Returns:
+        dict: Paths of the train CSV/.npz, test CSV/.npz and image tree,
+        the number of images and 'chance', the test accuracy of always
+        predicting the most common class
+    """
+    from common.convert import convert_csv_to_npz
+
+    rng = np.random.default_rng(seed)
+    paths = {}
+    for name, n in (('train', samples), ('test', test_samples)):
+        features = rng.random((n, N_FEATURES))
+        # Labels depend on the features so models have something to learn
+        target = np.minimum(features[:, :N_CLASSES].sum(axis=1).astype(int), N_CLASSES - 1)
+        csv_path = os.path.join(workdir, f'{name}.csv')
+        header = ','.join([str(i) for i in range(N_FEATURES)] + ['target'])
+        np.savetxt(csv_path, np.column_stack([features, target]), delimiter=',', header=header, comments='',
+                   fmt=['%.17g'] * N_FEATURES + ['%d'])
+        paths[f'{name}_csv'] = csv_path
+        paths[f'{name}_npz'] = os.path.join(workdir, f'{name}.npz')
+    paths['chance'] = float(np.bincount(target).max() / len(target))
+
+    if images:
+        import cv2
+        image_dir = os.path.join(workdir, 'images')
+        per_dir = images // (len(IMAGE_SPLITS) * len(IMAGE_CLASSES))
+        for split in IMAGE_SPLITS:
+            for class_name in IMAGE_CLASSES:
+                os.makedirs(os.path.join(image_dir, split, class_name))
+                for i in range(per_dir):
+                    cv2.imwrite(os.path.join(image_dir, split, class_name, f'{i}.png'),
+                                rng.integers(0, 256, (96, 96, 3), dtype=np.uint8))
+        paths['images'] = image_dir
+        paths['image_count'] = per_dir * len(IMAGE_SPLITS) * len(IMAGE_CLASSES)
+
+    paths['convert'] = {
+        name: convert_csv_to_npz(paths[f'{name}_csv'], paths[f'{name}_npz'], shape=(N_FEATURES, 1),
+                                 label_scale=LABEL_SCALE)
+        for name in ('train', 'test')
+    }
+    return paths
+
+
+def service_env(workdir, images_dir):
+    """Point every service's caches and scratch files into workdir"""
+    env = {
+        'MLFLOW_TRACKING_URI': f"file://{os.path.join(workdir, 'mlruns')}",
+        'LOADER_CACHE_DIR': os.path.join(workdir, 'loader_cache'),
+        'AUGMENTER_CACHE_DIR': os.path.join(workdir, 'augment_cache'),
+        'TRAINER_FEATURE_CACHE_DIR': os.path.join(workdir, 'feature_cache'),
+        'TRAINER_SCRATCH_DIR': workdir,
+        'SHAP_DIR': os.path.join(workdir, 'shap'),
+        'EVALUATOR_METRICS_DIR': os.path.join(workdir, 'metrics'),
+        # No config.yaml: requests say which technique and model to use
+        'AUGMENTER_CONFIG': os.path.join(workdir, 'missing.yaml'),
+        'TRAINER_CONFIG': os.path.join(workdir, 'missing.yaml')
+    }
+    if images_dir:
+        env['LOADER_DATA_DIR'] = images_dir
+    return env
+
+
+def load_service(name):
+    """
+    Import services/<name>/app.py and return its Flask test client
+
+    Services share module names (app, storage, ...), so each one's
+    modules are dropped from sys.modules before the next is imported;
+    the loaded app keeps its own references.
+    """
+    service_dir = os.path.join(SERVICES_DIR, name)
+    local = [f[:-3] for f in os.listdir(service_dir) if f.endswith('.py')]
+    for module in local:
+        sys.modules.pop(module, None)
+    sys.path.insert(0, service_dir)
+    try:
+        app = importlib.import_module('app')
+    finally:
+        sys.path.remove(service_dir)
+        for module in local:
+            sys.modules.pop(module, None)
+    return app.app.test_client()
+
+
+def run_stage(name, call, iterations, warmup, samples_per_call, check=None):
+    """
+    Time `iterations` calls of one endpoint after `warmup` untimed ones
+
+    Args:
+        call: Returns a Flask test response; non-2xx or status 'error' counts as an error
+        samples_per_call (int): Rows each call processes, for samples/s
+        check: Takes the JSON body of a successful response and returns
+            why it is wrong (counted as an error) or None
+
+    Returns:
+        dict: Counts, throughput, latency percentiles and RSS for the stage
+    """
+    def failure(response):
+        body = response.get_json(silent=True)
+        if not isinstance(body, dict):
+            body = {}
+        if response.status_code >= 300 or body.get('status') == 'error':
+            return body.get('message', response.status)
+        return check(body) if check is not None else None
+
+    for _ in range(warmup):
+        call()
+
+    latencies = []
+    errors = []
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            call_start = time.perf_counter()
+            response = call()
+            latencies.append(time.perf_counter() - call_start)
+            error = failure(response)
+            if error is not None:
+                errors.append(error)
+        wall = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000
+    report = {
+        'iterations': iterations,
+        'errors': len(errors),
+        'samples_per_call': samples_per_call,
+        'throughput_rps': iterations / wall if wall else 0.0,
+        'samples_per_s': iterations * samples_per_call / wall if wall else 0.0,
+        'latency_ms': {
+            'mean': float(ms.mean()),
+            'p50': float(np.percentile(ms, 50)),
+            'p95': float(np.percentile(ms, 95)),
+            'p99': float(np.percentile(ms, 99))
+        },
+        'rss_start_mb': rss.start_bytes / 2 ** 20,
+        'rss_peak_mb': rss.peak_bytes / 2 ** 20,
+        'rss_growth_mb': (rss.peak_bytes - rss.start_bytes) / 2 ** 20
+    }
+    if errors:
+        report['first_error'] = str(errors[0])
+    print(f"{name:>16}: {report['throughput_rps']:8.2f} req/s  p50 {report['latency_ms']['p50']:9.1f} ms  "
+          f"peak RSS {report['rss_peak_mb']:7.1f} MB  errors {len(errors)}", file=sys.stderr)
+    return report
+
+
+def expect(field, value, section=lambda body: body):
+    """Response check: section(body)[field] must equal value"""
+    def check(body):
+        found = section(body).get(field)
+        if found != value:
+            return f"{field} is {found}, expected {value}"
+    return check
+
+
+def above_chance(chance, section=lambda body: body):
+    """Response check: section(body)['accuracy'] must beat always predicting the most common class"""
+    def check(body):
+        accuracy = section(body).get('accuracy')
+        if accuracy is None or accuracy <= chance:
+            return f"accuracy {accuracy} is not above chance ({chance:.3f})"
+    return check
+
+
+def wait_for_artifacts(evaluator, job_ids, timeout=60):
+    """Let background MLflow uploads finish so they don't bleed into the next stage"""
+    deadline = time.time() + timeout
+    for job_id in job_ids:
+        while time.time() < deadline:
+            status = evaluator.get(f'/evaluate/status/{job_id}').get_json() or {}
+            if status.get('status') not in ('pending', 'running'):
+                break
+            time.sleep(0.05)
+
+
+def run_benchmark(args, workdir):
+    paths = make_datasets(workdir, args.samples, args.test_samples, args.images, args.seed)
+    os.environ.update(service_env(workdir, paths.get('images')))
+
+    stages = {}
+    train = dict(json.loads(args.train_config), data_path=paths['train_npz'])
+    augment = {'type': 'mixup', 'params': {'alpha': 0.2}, 'input_path': paths['train_npz'],
+               'output_path': os.path.join(workdir, 'augmented.npz')}
+
+    if args.images:
+        try:
+            loader = load_service('data_loader')
+        except ImportError as e:
+            print(f"Skipping /load: {e}", file=sys.stderr)
+        else:
+            # The first call ingests, later ones hit the packed store
+            loaded = expect('total_images', paths['image_count'], lambda body: body.get('data_stats', {}))
+            stages['load_ingest'] = run_stage(
+                'load_ingest', lambda: loader.post('/load', json={}), 1, 0, args.images, loaded
+            )
+            stages['load'] = run_stage(
+                'load', lambda: loader.post('/load', json={}), args.iterations, 0, args.images, loaded
+            )
+
+    augmenter = load_service('augmenter')
+    # Unseeded mixup is never served from the result cache
+    stages['augment'] = run_stage(
+        'augment', lambda: augmenter.post('/augment', json=augment),
+        args.iterations, args.warmup, args.samples, expect('output_samples', args.samples)
+    )
+    seeded = dict(augment, params={'alpha': 0.2, 'seed': 0})
+    stages['augment_cached'] = run_stage(
+        'augment_cached', lambda: augmenter.post('/augment', json=seeded),
+        args.iterations, max(args.warmup, 1), args.samples, expect('output_samples', args.samples)
+    )
+
+    trainer = load_service('trainer')
+    trained = {}
+
+    def quick_test():
+        response = trainer.post('/quick_test', json=train)
+        trained.update(response.get_json(silent=True) or {})
+        return response
+    # Training accuracy, so the bar is low; it catches labels or models gone wrong
+    stages['quick_test'] = run_stage('quick_test', quick_test, args.iterations, args.warmup, args.samples,
+                                     above_chance(paths['chance']))
+
+    if not trained.get('model_uri'):
+        print(f"No model to evaluate: {trained.get('message')}", file=sys.stderr)
+        return paths, stages
+
+    evaluator = load_service('evaluator')
+    job_ids = []
+
+    def evaluate(config):
+        def call():
+            response = evaluator.post('/evaluate', json=dict(config, model_uri=trained['model_uri']))
+            job_ids.append((response.get_json(silent=True) or {}).get('artifact_job_id'))
+            return response
+        return call
+    scored = above_chance(paths['chance'], lambda body: body.get('metrics', {}))
+    stages['evaluate'] = run_stage(
+        'evaluate', evaluate({'data_path': paths['test_csv']}),
+        args.iterations, args.warmup, args.test_samples, scored
+    )
+    wait_for_artifacts(evaluator, [job_id for job_id in job_ids if job_id])
+    stages['evaluate_stream'] = run_stage(
+        'evaluate_stream', evaluate({'data_path': paths['test_npz'], 'stream': True}),
+        args.iterations, args.warmup, args.test_samples, scored
+    )
+    wait_for_artifacts(evaluator, [job_id for job_id in job_ids if job_id])
+    return paths, stages
+
+
+def compare(report, baseline, tolerance):
+    """
+    Stages whose throughput fell more than `tolerance` below the baseline's
+
+    Returns:
+        dict: Stage -> {'baseline_rps', 'rps', 'ratio'} for every shared stage
+        list: Names of the regressed stages
+    """
+    comparison = {}
+    regressed = []
+    for name, stage in report['stages'].items():
+        before = baseline.get('stages', {}).get(name)
+        if not before or not before['throughput_rps']:
+            continue
+        ratio = stage['throughput_rps'] / before['throughput_rps']
+        comparison[name] = {'baseline_rps': before['throughput_rps'], 'rps': stage['throughput_rps'], 'ratio': ratio}
+        if ratio < 1 - tolerance:
+            regressed.append(name)
+    return comparison, regressed
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=10000, help='Training rows (the HyperK sample has 100)')
+    parser.add_argument('--test-samples', type=int, default=2000, help='Evaluation rows')
+    parser.add_argument('--images', type=int, default=64, help='Images in the loader tree, 0 skips /load')
+    parser.add_argument('--iterations', type=int, default=5, help='Timed calls per stage')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed calls per stage first')
+    parser.add_argument('--train-config', default='{"model": {"type": "LogisticRegression", "params": {"max_iter": 200}}}',
+                        help='JSON /quick_test request, data_path is filled in')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='Keep datasets and caches here instead of a temp directory')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare throughput against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed throughput drop vs the baseline')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # Services print debug output, keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.workdir:
+            os.makedirs(args.workdir, exist_ok=True)
+            paths, stages = run_benchmark(args, args.workdir)
+        else:
+            with tempfile.TemporaryDirectory(prefix='pipeline-bench-') as workdir:
+                paths, stages = run_benchmark(args, workdir)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'config': {
+            'samples': args.samples,
+            'test_samples': args.test_samples,
+            'images': args.images,
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'train_config': json.loads(args.train_config)
+        },
+        'convert': {
+            name: {key: stats[key] for key in ('rows', 'seconds', 'rows_per_sec', 'mb_per_sec')}
+            for name, stats in paths['convert'].items()
+        },
+        'chance_accuracy': paths['chance'],
+        'stages': stages,
+        'seconds': time.perf_counter() - start
+    }
+
+    regressed = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'], regressed = compare(report, json.load(f), args.tolerance)
+        report['regressed'] = regressed
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    failed = [name for name, stage in stages.items() if stage['errors']]
+    if failed:
+        print(f"Stages with failed or wrong responses: {', '.join(failed)}", file=sys.stderr)
+    if regressed:
+        print(f"Throughput regressed by more than {args.tolerance:.0%}: {', '.join(regressed)}", file=sys.stderr)
+    if failed or regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Benchmark: in-band array bodies (.npz / Arrow IPC) vs file-path handoff"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'services'))
+from common.transport import (  # noqa: E402
+    ARROW_MIMETYPE, NPZ_MIMETYPE, decode_arrays, encode_npz, iter_arrow, pa
+)
+from orchestrator import make_session  # noqa: E402
+
+
+def time_call(fn, repeats):
+    """Return the best wall time over several runs"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def file_round_trip(arrays, path):
+    """What a path handoff costs: one service writes, the next one reads"""
+    np.savez(path, **arrays)
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def local_benchmark(sizes, shape, repeats):
+    """Serialize + deserialize cost of each transport, no network involved"""
+    formats = ['file', 'npz'] + (['arrow'] if pa is not None else [])
+    print(f"{'samples':>10} {'MB':>8}" + ''.join(f"{name + ' (s)':>12}" for name in formats))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'handoff.npz')
+        for n in sizes:
+            rng = np.random.default_rng(0)
+            arrays = {
+                'images': rng.random((n, *shape), dtype=np.float32),
+                'labels': rng.integers(0, 4, n).astype(np.int64)
+            }
+            calls = {
+                'file': lambda: file_round_trip(arrays, path),
+                'npz': lambda: decode_arrays(encode_npz(arrays), NPZ_MIMETYPE),
+                'arrow': lambda: decode_arrays(b''.join(iter_arrow(arrays)), ARROW_MIMETYPE)
+            }
+            mb = sum(array.nbytes for array in arrays.values()) / 1e6
+            times = [time_call(calls[name], repeats) for name in formats]
+            print(f"{n:>10} {mb:>8.1f}" + ''.join(f"{t:>12.4f}" for t in times))
+
+
+def chain_by_path(session, urls, augment, train):
+    """load -> augment -> quick_test, each stage reading the previous one's file"""
+    loaded = session.post(f"{urls['data_loader']}/load", json={}).json()
+    augmented = session.post(f"{urls['augmenter']}/augment",
+                             json=dict(augment, input_path=loaded['path'])).json()
+    if augmented['status'] != 'success':
+        raise RuntimeError(augmented.get('message'))
+    return session.post(f"{urls['trainer']}/quick_test",
+                        json=dict(train, data_path=augmented['output_path'])).json()
+
+
+def chain_in_band(session, urls, augment, train, mimetype):
+    """load -> augment -> quick_test with every array in request/response bodies"""
+    loaded = session.post(f"{urls['data_loader']}/load", json={}, headers={'Accept': mimetype})
+    loaded.raise_for_status()
+    augmented = session.post(
+        f"{urls['augmenter']}/augment", data=loaded.content,
+        params={'config': json.dumps(augment)}, headers={'Content-Type': mimetype}
+    )
+    augmented.raise_for_status()
+    if augmented.headers.get('Content-Type', '').startswith('application/json'):
+        raise RuntimeError(augmented.json().get('message'))
+    return session.post(
+        f"{urls['trainer']}/quick_test", data=augmented.content,
+        params={'config': json.dumps(train)}, headers={'Content-Type': mimetype}
+    ).json()
+
+
+def services_benchmark(urls, augment, train, repeats, formats):
+    """Wall time of the full chain against running services"""
+    session = make_session()
+    runs = {'path': lambda: chain_by_path(session, urls, augment, train)}
+    for name in formats:
+        mimetype = NPZ_MIMETYPE if name == 'npz' else ARROW_MIMETYPE
+        runs[name] = lambda mimetype=mimetype: chain_in_band(session, urls, augment, train, mimetype)
+
+    baseline = None
+    print(f"{'transport':>10} {'chain (s)':>10} {'vs path':>8}")
+    for name, run in runs.items():
+        seconds = time_call(run, repeats)
+        baseline = baseline or seconds
+        print(f"{name:>10} {seconds:>10.3f} {baseline / seconds:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mode', choices=('local', 'services'), default='local')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--shape', type=int, nargs='+', default=[20, 1],
+                        help='Per-sample shape (HyperK samples are 20x1)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--formats', nargs='+', default=['npz', 'arrow'], choices=('npz', 'arrow'),
+                        help='In-band formats to compare against the path flow (services mode)')
+    parser.add_argument('--loader', default='http://localhost:5001')
+    parser.add_argument('--augmenter', default='http://localhost:5002')
+    parser.add_argument('--trainer', default='http://localhost:5003')
+    parser.add_argument('--output-path', default='/app/data/benchmark_transport.npz',
+                        help='Augmenter output for the path flow')
+    args = parser.parse_args()
+
+    if args.mode == 'local':
+        local_benchmark(args.sizes, args.shape, args.repeats)
+        return
+
+    urls = {'data_loader': args.loader, 'augmenter': args.augmenter, 'trainer': args.trainer}
+    # Unseeded, so the path flow is never served from the augmenter's result cache
+    augment = {'type': 'mixup', 'params': {'alpha': 0.2}, 'output_path': args.output_path}
+    train = {'model': {'type': 'SGDClassifier', 'params': {'loss': 'log_loss'}}, 'shap_async': True}
+    services_benchmark(urls, augment, train, args.repeats, args.formats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Load test: throughput and latency of one endpoint at increasing concurrency"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from orchestrator import make_session
+
+
+def client_body(body, client_id):
+    """
+    The body one client sends: its own output_path, if the body has one
+
+    Clients writing the same file would only measure contention on it.
+    """
+    if not isinstance(body, dict) or 'output_path' not in body:
+        return body
+    stem, ext = os.path.splitext(body['output_path'])
+    return dict(body, output_path=f"{stem}.client{client_id}{ext}")
+
+
+def failure(response):
+    """
+    Why a response counts as an error, None if it doesn't
+
+    Services answer some application errors with HTTP 200, so a JSON body
+    must also say status 'success'.
+    """
+    if not response.ok:
+        return f"HTTP {response.status_code}"
+    if not response.headers.get('Content-Type', '').startswith('application/json'):
+        return None
+    try:
+        status = response.json().get('status')
+    except (ValueError, AttributeError):
+        return 'Invalid JSON body'
+    if status != 'success':
+        return response.json().get('message') or f"status {status}"
+    return None
+
+
+def run_level(url, method, body, concurrency, duration):
+    """
+    Keep `concurrency` clients busy for `duration` seconds
+
+    Each client has its own pooled session so connections are reused, as
+    they would be behind a real caller.
+
+    Returns:
+        dict: Request count, errors, throughput and latency percentiles
+        of the successful requests
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(client_id):
+        session = make_session(pool_size=1)
+        own_body = client_body(body, client_id)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                error = failure(session.request(method, url, json=own_body, timeout=duration * 10))
+            except Exception as e:
+                error = str(e)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if error is None:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(error)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for client_id in range(concurrency):
+            pool.submit(client, client_id)
+    wall = time.perf_counter() - start
+
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    result = {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': len(latencies) / wall,
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99))
+    }
+    if errors:
+        result['first_error'] = errors[0]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='http://localhost:5002/augment')
+    parser.add_argument('--method', default='POST')
+    # Unseeded mixup is never served from the augmenter's result cache
+    # Each client writes its own copy of output_path (see client_body)
+    parser.add_argument('--body', default='{"type": "mixup", "params": {"alpha": 0.2}, '
+                                          '"input_path": "/app/data/hyperk_sample.npz", '
+                                          '"output_path": "/app/data/load_test.npz"}',
+                        help='JSON request body')
+    parser.add_argument('--body-file', help='Read the JSON body from a file instead')
+    parser.add_argument('--concurrency', default='1,2,4,8', help='Comma-separated client counts')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per concurrency level')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    if args.body_file:
+        with open(args.body_file) as f:
+            body = json.load(f)
+    else:
+        body = json.loads(args.body) if args.body else None
+
+    results = []
+    for concurrency in (int(level) for level in args.concurrency.split(',')):
+        results.append(run_level(args.url, args.method, body, concurrency, args.duration))
+        if not args.json:
+            r = results[-1]
+            if len(results) == 1:
+                print(f"{'clients':>8}{'req/s':>10}{'scaling':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+            scaling = r['throughput_rps'] / results[0]['throughput_rps'] if results[0]['throughput_rps'] else 0.0
+            print(f"{r['concurrency']:>8}{r['throughput_rps']:>10.1f}{scaling:>8.2f}x"
+                  f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['errors']:>8}")
+            if r['errors']:
+                print(f"{'':>8}first error: {r['first_error']}")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
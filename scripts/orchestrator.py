@@ -0,0 +1,190 @@
+"""DAG runner for the pipeline services: pooled connections, parallel stages, cached results"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Results of finished stages, reused by later runs when a stage's key matches
+CACHE_PATH = os.getenv('PIPELINE_CACHE_PATH', os.path.join(os.path.dirname(__file__), '.pipeline_cache.json'))
+
+
+def make_session(pool_size=16):
+    """requests.Session whose connection pool is sized for pool_size concurrent calls"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def wait_for_service(session, url, timeout=30, interval=1):
+    """Poll url/health until it answers 200 or the timeout expires"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if session.get(f"{url}/health", timeout=interval * 5).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(interval)
+    return False
+
+
+def wait_for_job(session, url, job_id, timeout=600, interval=1):
+    """
+    Poll a trainer job until it finishes and return its result
+
+    Raises:
+        requests.HTTPError: If a poll fails (e.g. the job is unknown)
+        RuntimeError: If the job failed or finished with status 'error'
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        res = session.get(f"{url}/jobs/{job_id}")
+        res.raise_for_status()
+        job = res.json()
+        if job['status'] in ('failed', 'error'):
+            raise RuntimeError(f"Training job {job_id} failed: {job.get('error') or job.get('message')}")
+        if job['status'] == 'done':
+            result = job['result']
+            if result.get('status') == 'error':
+                raise RuntimeError(f"Training job {job_id} failed: {result.get('message')}")
+            return result
+        time.sleep(interval)
+    raise TimeoutError(f"Training job {job_id} did not finish in {timeout}s")
+
+
+class Pipeline:
+    """
+    Run stages as a DAG on a thread pool
+
+    A stage is ``fn(inputs)`` where inputs maps each dependency's name to
+    its result. Every stage whose dependencies have finished runs at once,
+    so independent branches fan out. A stage added with ``key`` is skipped
+    when ``key(inputs)`` matches a result stored by an earlier run. If a
+    stage fails, everything downstream of it is skipped.
+    """
+
+    def __init__(self, workers=4, cache_path=CACHE_PATH, use_cache=True):
+        self.workers = workers
+        self.cache_path = cache_path
+        self.use_cache = use_cache
+        self.report = OrderedDict()
+        self._stages = OrderedDict()
+        self._lock = threading.Lock()
+        self._cache = self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_cache(self):
+        tmp = self.cache_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._cache, f, indent=2)
+        os.replace(tmp, self.cache_path)
+
+    def add(self, name, fn, deps=(), key=None):
+        """
+        Register a stage
+
+        Dependencies must be added first, which also rules out cycles.
+
+        Args:
+            name (str): Unique stage name
+            fn (callable): fn(inputs) -> JSON-serializable result
+            deps (tuple): Names of stages whose results fn needs
+            key (callable): key(inputs) -> JSON-serializable cache key (optional)
+        """
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"Stage {name} depends on unknown stages: {missing}")
+        self._stages[name] = {'fn': fn, 'deps': tuple(deps), 'key': key}
+
+    def _run_stage(self, name, stage, inputs, started_at):
+        cache_key = None
+        if stage['key'] is not None:
+            payload = json.dumps([name, stage['key'](inputs)], sort_keys=True, default=str)
+            cache_key = hashlib.sha256(payload.encode()).hexdigest()
+            with self._lock:
+                cached = self._cache.get(cache_key) if self.use_cache else None
+            if cached is not None:
+                return cached, {'status': 'cached', 'start': started_at, 'seconds': 0.0}
+
+        start = time.perf_counter()
+        result = stage['fn'](inputs)
+        seconds = time.perf_counter() - start
+        if cache_key is not None:
+            with self._lock:
+                self._cache[cache_key] = result
+        return result, {'status': 'ran', 'start': started_at, 'seconds': seconds}
+
+    def run(self):
+        """
+        Execute every stage
+
+        Returns:
+            dict: Stage name -> result, for stages that succeeded
+        """
+        results = {}
+        failed = set()
+        pending = OrderedDict(self._stages)
+        running = {}
+        origin = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if any(dep in failed for dep in stage['deps']):
+                        failed.add(name)
+                        self.report[name] = {'status': 'skipped', 'error': 'upstream stage failed'}
+                        del pending[name]
+                    elif all(dep in results for dep in stage['deps']):
+                        inputs = {dep: results[dep] for dep in stage['deps']}
+                        started_at = time.perf_counter() - origin
+                        running[pool.submit(self._run_stage, name, stage, inputs, started_at)] = name
+                        del pending[name]
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name], self.report[name] = future.result()
+                    except Exception as e:
+                        failed.add(name)
+                        self.report[name] = {
+                            'status': 'failed',
+                            'start': time.perf_counter() - origin,
+                            'error': str(e)
+                        }
+
+        self.total_seconds = time.perf_counter() - origin
+        self.failed = sorted(failed)
+        self._save_cache()
+        return results
+
+    def print_report(self):
+        """Per-stage status, start offset and duration"""
+        print(f"\n{'stage':<32}{'status':>9}{'start (s)':>11}{'time (s)':>10}")
+        for name, entry in self.report.items():
+            start = f"{entry['start']:.2f}" if 'start' in entry else '-'
+            seconds = f"{entry['seconds']:.2f}" if 'seconds' in entry else '-'
+            print(f"{name:<32}{entry['status']:>9}{start:>11}{seconds:>10}")
+            if 'error' in entry:
+                print(f"    {entry['error']}")
+        ran = sum(entry.get('seconds', 0.0) for entry in self.report.values())
+        print(f"Wall time {self.total_seconds:.2f}s for {ran:.2f}s of stage work")
@@ -1,8 +1,10 @@
-import requests
+import argparse
+import json
 import os
-import time
 from dotenv import load_dotenv
 
+from orchestrator import Pipeline, make_session, wait_for_job, wait_for_service
+
 load_dotenv()
 
 SERVICES = {
@@ -12,87 +14,138 @@ SERVICES = {
     "evaluator": "http://localhost:5004"
 }
 
-def wait_for_service(url, timeout=30):
-    """Wait for service to become available"""
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            if requests.get(f"{url}/health").status_code == 200:
-                return True
-        except requests.exceptions.ConnectionError:
-            time.sleep(1)
-    return False
-
-def run_pipeline():
-    print("🚀 Starting ML Pipeline")
-    
-    # 1. Load Data
-    print("\n📂 [1/4] Loading data...")
-    load_res = requests.post(
-        f"{SERVICES['data_loader']}/load",
-        json={"file_path": os.getenv("DATA_INPUT_PATH")}
-    )
-    load_res.raise_for_status()
-    processed_path = load_res.json()['path']
-    print(f"Data loaded and processed to: {processed_path}")
-
-    # 2. Augment Data
-    print("\n✨ [2/4] Augmenting data...")
-    augment_res = requests.post(
-        f"{SERVICES['augmenter']}/augment",
-        json={
-            "type": "basic",
-            "params": {
-                "rotate": int(os.getenv("AUG_ROTATION")),
-                "flip": os.getenv("AUG_FLIP") == "True",
-                "brightness": float(os.getenv("AUG_BRIGHTNESS_ADJUST"))
-            },
-            "input_path": processed_path,
-            "output_path": os.getenv("DATA_OUTPUT_PATH")
-        }
-    )
-    augment_res.raise_for_status()
-    augmented_path = augment_res.json()['output_path']
-    print(f"Augmented data saved to: {augmented_path}")
-
-    # 3. Train Model
-    print("\n🤖 [3/4] Training model...")
-    train_res = requests.post(
-        f"{SERVICES['trainer']}/train",
-        json={"data_path": augmented_path}
-    )
-    train_res.raise_for_status()
-    model_uri = train_res.json()['model_uri']
-    print(f"Model trained and saved to: {model_uri}")
-
-    # 4. Evaluate Model
-    print("\n📊 [4/4] Evaluating model...")
-    eval_res = requests.post(
-        f"{SERVICES['evaluator']}/evaluate",
-        json={
-            "data_path": os.getenv("TEST_DATA_PATH"),
-            "model_uri": model_uri
+def default_augmentations():
+    """The single augmentation configured through .env"""
+    return [{
+        "name": "default",
+        "type": "basic",
+        "params": {
+            "rotate": int(os.getenv("AUG_ROTATION")),
+            "flip": os.getenv("AUG_FLIP") == "True",
+            "brightness": float(os.getenv("AUG_BRIGHTNESS_ADJUST"))
         }
-    )
-    eval_res.raise_for_status()
-    print("\nEvaluation Results:")
-    for metric, value in eval_res.json()['metrics'].items():
-        print(f"- {metric}: {value:.4f}")
-    
+    }]
+
+def output_path_for(name, fan_out):
+    """DATA_OUTPUT_PATH, suffixed with the variant name when several run"""
+    path = os.getenv("DATA_OUTPUT_PATH")
+    if not fan_out:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}_{name}{ext}"
+
+def build_pipeline(session, augmentations, workers=4, use_cache=True):
+    """
+    Wire load -> augment -> train -> evaluate, one branch per augmentation
+
+    Branches run concurrently. Augment, train and evaluate are skipped when
+    their inputs match a previous run: the loader's store path and the
+    augmenter's output hash are content-addressed, so a cached result is
+    only reused for identical data.
+    """
+    pipeline = Pipeline(workers=workers, use_cache=use_cache)
+    fan_out = len(augmentations) > 1
+
+    def load(inputs):
+        res = session.post(f"{SERVICES['data_loader']}/load", json={"file_path": os.getenv("DATA_INPUT_PATH")})
+        res.raise_for_status()
+        return res.json()
+
+    pipeline.add("load", load)
+
+    for variant in augmentations:
+        name = variant["name"]
+        request = {key: value for key, value in variant.items() if key != "name"}
+        request["output_path"] = output_path_for(name, fan_out)
+
+        def augment(inputs, name=name, request=request):
+            res = session.post(
+                f"{SERVICES['augmenter']}/augment",
+                json=dict(request, input_path=inputs["load"]["path"])
+            )
+            res.raise_for_status()
+            body = res.json()
+            if body['status'] != 'success':
+                raise RuntimeError(f"Augmentation {name} failed: {body.get('message')}")
+            return body
+
+        def train(inputs, name=name):
+            res = session.post(
+                f"{SERVICES['trainer']}/train",
+                json={"data_path": inputs[f"augment:{name}"]["output_path"]}
+            )
+            res.raise_for_status()
+            return wait_for_job(session, SERVICES['trainer'], res.json()['job_id'])
+
+        def evaluate(inputs, name=name):
+            res = session.post(
+                f"{SERVICES['evaluator']}/evaluate",
+                json={
+                    "data_path": os.getenv("TEST_DATA_PATH"),
+                    "model_uri": inputs[f"train:{name}"]["model_uri"]
+                }
+            )
+            res.raise_for_status()
+            return res.json()
+
+        pipeline.add(
+            f"augment:{name}", augment, deps=("load",),
+            key=lambda inputs, request=request: [inputs["load"]["path"], request]
+        )
+        pipeline.add(
+            f"train:{name}", train, deps=(f"augment:{name}",),
+            key=lambda inputs, name=name: inputs[f"augment:{name}"]["datasets"]["output"]["sha256"]
+        )
+        pipeline.add(
+            f"evaluate:{name}", evaluate, deps=(f"train:{name}",),
+            key=lambda inputs, name=name: [inputs[f"train:{name}"]["model_uri"], os.getenv("TEST_DATA_PATH")]
+        )
+
+    return pipeline
+
+def run_pipeline(augmentations, workers=4, use_cache=True):
+    print("🚀 Starting ML Pipeline")
+    session = make_session(pool_size=workers * 2)
+    pipeline = build_pipeline(session, augmentations, workers, use_cache)
+    results = pipeline.run()
+
+    for variant in augmentations:
+        evaluation = results.get(f"evaluate:{variant['name']}")
+        if evaluation is None:
+            continue
+        print(f"\n📊 Evaluation results ({variant['name']}):")
+        for metric, value in evaluation['metrics'].items():
+            print(f"- {metric}: {value:.4f}")
+
+    pipeline.print_report()
+    if pipeline.failed:
+        raise RuntimeError(f"Stages failed: {pipeline.failed}")
     print("\n🎉 Pipeline completed successfully!")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run load -> augment -> train -> evaluate")
+    parser.add_argument("--augmentations", help="JSON file with a list of augment requests, each with a unique name")
+    parser.add_argument("--workers", type=int, default=4, help="Stages run concurrently")
+    parser.add_argument("--no-cache", action="store_true", help="Rerun every stage")
+    args = parser.parse_args()
+
+    augmentations = default_augmentations()
+    if args.augmentations:
+        with open(args.augmentations) as f:
+            augmentations = json.load(f)
+
     # Verify services are ready
     print("🔍 Checking services...")
+    session = make_session()
     for name, url in SERVICES.items():
-        if wait_for_service(url):
+        if wait_for_service(session, url):
             print(f"✔ {name} is ready")
         else:
             print(f"✖ {name} failed to start")
             exit(1)
 
     try:
-        run_pipeline()
-    except requests.exceptions.RequestException as e:
+        run_pipeline(augmentations, args.workers, not args.no_cache)
+    except RuntimeError as e:
         print(f"\n❌ Pipeline failed: {str(e)}")
-        exit(1)
\ No newline at end of file
+        exit(1)
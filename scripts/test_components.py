@@ -60,7 +60,18 @@ def test_trainer(data_path):
     )
     print(f"Status: {res.status_code}")
     print(f"Response: {res.json()}")
-    return res.json()['model_uri']
+    job_id = res.json()['job_id']
+
+    # Training runs as a background job, poll until it finishes
+    while True:
+        job = requests.get(f"{SERVICES['trainer']}/jobs/{job_id}").json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(1)
+    print(f"Job: {job['status']}")
+    if job['status'] == 'failed':
+        raise RuntimeError(f"Training job {job_id} failed: {job.get('error')}")
+    return job['result']['model_uri']
 
 def test_evaluator(model_uri, test_data_path):
     print("\n=== Testing Evaluator ===")
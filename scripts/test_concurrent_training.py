@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Concurrent /train jobs must each log their own model and params
+
+Runs the trainer in-process with several queue workers, submits one job
+per model type at once and checks every returned model_uri holds a
+model of that type in a run carrying that job's params. Run directly or
+with pytest.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SCRATCH = tempfile.mkdtemp(prefix='concurrent-training-')
+os.environ.setdefault('MLFLOW_TRACKING_URI', 'file://' + os.path.join(SCRATCH, 'mlruns'))
+os.environ.setdefault('TRAINER_FEATURE_CACHE_DIR', os.path.join(SCRATCH, 'feature_cache'))
+os.environ.setdefault('SHAP_DIR', os.path.join(SCRATCH, 'shap'))
+os.environ['TRAINER_WORKERS'] = '4'
+
+SERVICES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services')
+sys.path.insert(0, SERVICES)
+sys.path.insert(0, os.path.join(SERVICES, 'trainer'))
+import mlflow.sklearn  # noqa: E402
+from mlflow.tracking import MlflowClient  # noqa: E402
+
+import app as trainer  # noqa: E402
+
+MODELS = [
+    {'type': 'LogisticRegression', 'params': {'max_iter': 200}},
+    {'type': 'DecisionTreeClassifier', 'params': {'max_depth': 3}},
+    {'type': 'RandomForestClassifier', 'params': {'n_estimators': 5}},
+    {'type': 'SGDClassifier', 'params': {'loss': 'log_loss'}},
+]
+
+
+def make_dataset(path, n_samples=500):
+    rng = np.random.default_rng(0)
+    images = rng.random((n_samples, 20, 1), dtype=np.float32)
+    labels = (images[:, :2, 0].sum(axis=1) > 1).astype(np.int64) * 4
+    np.savez(path, images=images, labels=labels)
+    return path
+
+
+def wait_for_job(client, job_id, timeout=300):
+    start = time.time()
+    while time.time() - start < timeout:
+        job = client.get(f'/jobs/{job_id}').json
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.2)
+    raise TimeoutError(f'Job {job_id} did not finish within {timeout}s')
+
+
+def test_concurrent_jobs_log_to_their_own_runs():
+    data_path = make_dataset(os.path.join(SCRATCH, 'train.npz'))
+    client = trainer.app.test_client()
+    mlflow_client = MlflowClient()
+
+    job_ids = []
+    for spec in MODELS:
+        res = client.post('/train', json={'data_path': data_path, 'model': spec, 'shap_async': True})
+        assert res.status_code == 202, res.json
+        job_ids.append(res.json['job_id'])
+
+    for spec, job_id in zip(MODELS, job_ids):
+        job = wait_for_job(client, job_id)
+        assert job['status'] == 'done', job.get('error')
+        result = job['result']
+
+        run = mlflow_client.get_run(result['run_id'])
+        assert run.data.params['model_type'] == spec['type'], run.data.params
+        for key, value in spec['params'].items():
+            assert run.data.params[key] == str(value), run.data.params
+
+        artifacts = {artifact.path for artifact in mlflow_client.list_artifacts(result['run_id'], 'model')}
+        assert 'model/MLmodel' in artifacts, f"{spec['type']}: no model in run {result['run_id']}"
+        model = mlflow.sklearn.load_model(result['model_uri'])
+        assert type(model).__name__ == spec['type'], (spec['type'], type(model).__name__)
+
+
+if __name__ == '__main__':
+    test_concurrent_jobs_log_to_their_own_runs()
+    print(f'✅ {len(MODELS)} concurrent training jobs logged to their own runs')
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Arrays must survive an in-band round trip in every transport format
+
+Encodes arrays the way services answer with them (common.transport) and
+decodes them back, including the empty case a /load of an empty split
+produces. Run directly or with pytest; Arrow cases are skipped without
+pyarrow.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services'))
+from common.transport import ARROW_MIMETYPE, NPZ_MIMETYPE, decode_arrays, encode_npz, iter_arrow, pa  # noqa: E402
+
+
+def make_arrays(n_rows):
+    rng = np.random.default_rng(0)
+    return {
+        'images': rng.integers(0, 256, (n_rows, 4, 3, 3), dtype=np.uint8),
+        'labels': rng.integers(0, 5, n_rows).astype(np.int64),
+        'classes': np.array(['normal', 'polyp'])
+    }
+
+
+def encode(arrays, mimetype):
+    if mimetype == ARROW_MIMETYPE:
+        return b''.join(iter_arrow(arrays, batch_rows=3))
+    return encode_npz(arrays)
+
+
+def check_round_trip(mimetype):
+    for n_rows in (0, 1, 7):
+        arrays = make_arrays(n_rows)
+        decoded = decode_arrays(encode(arrays, mimetype), mimetype)
+        assert decoded.keys() == arrays.keys(), (mimetype, n_rows, decoded.keys())
+        for name, array in arrays.items():
+            assert decoded[name].shape == array.shape, (mimetype, n_rows, name, decoded[name].shape)
+            assert decoded[name].dtype == array.dtype, (mimetype, n_rows, name, decoded[name].dtype)
+            assert np.array_equal(decoded[name], array), (mimetype, n_rows, name)
+
+
+def test_npz_round_trip():
+    check_round_trip(NPZ_MIMETYPE)
+
+
+def test_arrow_round_trip():
+    if pa is None:
+        import pytest
+        pytest.skip('pyarrow is not installed')
+    check_round_trip(ARROW_MIMETYPE)
+
+
+if __name__ == '__main__':
+    test_npz_round_trip()
+    if pa is not None:
+        test_arrow_round_trip()
+    print('✅ arrays round-trip through every available transport, empty ones included')
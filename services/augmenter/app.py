@@ -1,28 +1,138 @@
 from flask import Flask, request, jsonify
 import numpy as np
-from techniques import apply_augmentation
-import mlflow
+from techniques import apply_augmentation, augmentation_steps
+from common.digest import content_digest
+from common.npz import open_arrays
+from result_cache import is_cacheable, request_key, result_cache
+from common.tracking import batched_run
+from common.transport import array_response, decode_arrays, is_binary, request_config, response_mimetype
+from mlflow.entities import Dataset
+import hashlib
 import json
 import os
 
 app = Flask(__name__)
 
+def describe_dataset(path, digest):
+    """Build an MLflow dataset reference (hash, shapes, dtypes, path) without reading the data"""
+    arrays = open_arrays(path)
+    schema = {name: {'shape': list(array.shape), 'dtype': str(array.dtype)} for name, array in arrays.items()}
+    return Dataset(
+        name=os.path.basename(os.path.normpath(path)),
+        digest=digest[:16],
+        source_type='local',
+        source=json.dumps({'uri': os.path.abspath(path), 'sha256': digest}),
+        schema=json.dumps(schema),
+        profile=json.dumps({'num_rows': len(arrays['images'])})
+    )
+
+def find_stored_copy(client, digest):
+    """Artifact URI of an earlier full copy of the same bytes, if any run logged one"""
+    experiment_ids = [e.experiment_id for e in client.search_experiments()]
+    for context in ('input', 'output'):
+        runs = client.search_runs(
+            experiment_ids, filter_string=f"tags.stored_{context}_sha256 = '{digest}'", max_results=1
+        )
+        if runs:
+            return runs[0].data.tags[f'stored_{context}_artifact_uri']
+    return None
+
+def log_dataset(run, tracker, path, context, copy=False):
+    """
+    Log a dataset by reference, optionally with a deduplicated full copy
+
+    The reference (content hash, shapes, dtypes, path) is always logged as
+    an MLflow dataset input. With copy=True the bytes are uploaded too,
+    unless a run already stored an identical file, in which case only a
+    tag pointing at that copy is written.
+    """
+    digest = content_digest(path)
+    tracker.log_input(describe_dataset(path, digest), context)
+    tracker.set_tag(f'{context}_sha256', digest)
+    if not copy:
+        return {'sha256': digest, 'uploaded': False}
+
+    existing = find_stored_copy(tracker.client, digest)
+    if existing:
+        tracker.set_tag(f'{context}_artifact_uri', existing)
+        return {'sha256': digest, 'uploaded': False, 'artifact_uri': existing}
+
+    artifact_uri = f"{run.info.artifact_uri}/{context}/{os.path.basename(os.path.normpath(path))}"
+    tracker.log_artifact(path, context)
+    tracker.set_tags({
+        f'stored_{context}_sha256': digest,
+        f'stored_{context}_artifact_uri': artifact_uri,
+        f'{context}_artifact_uri': artifact_uri
+    })
+    return {'sha256': digest, 'uploaded': True, 'artifact_uri': artifact_uri}
+
+def log_augmentation(tracker, steps, result):
+    """Log the techniques, their params and the mix ratio of a finished request"""
+    tracker.log_param('augmentation_type', '+'.join(step['type'] for step in steps))
+    if len(steps) == 1:
+        tracker.log_params(steps[0]['params'])
+    else:
+        tracker.log_params({
+            f"{i}.{step['type']}.{key}": value
+            for i, step in enumerate(steps) for key, value in step['params'].items()
+        })
+    tracker.log_metric('mix_ratio', result['mix_ratio'])
+
+def augment_in_band():
+    """
+    /augment with the arrays in the request body (.npz or Arrow IPC)
+
+    The config travels in the ``config`` query parameter and the output
+    comes back in the body, in the format named by Accept (default: the
+    request's), so nothing touches the shared volume. The result cache is
+    path based and not used here.
+    """
+    body = request.get_data()
+    try:
+        config = request_config(request)
+        steps = augmentation_steps(config)
+        arrays = decode_arrays(body, request.mimetype)
+        mimetype = response_mimetype(request)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    config['pipeline'] = steps
+
+    with batched_run() as (run, tracker):
+        result = apply_augmentation(config, arrays=arrays)
+        if result['status'] != 'success':
+            return jsonify(result)
+        output = result.pop('arrays')
+        log_augmentation(tracker, steps, result)
+        tracker.set_tags({'transport': 'in-band', 'input_sha256': hashlib.sha256(body).hexdigest()})
+
+    return array_response(output, mimetype, result)
+
 @app.route('/augment', methods=['POST'])
 def augment():
     try:
+        if is_binary(request):
+            return augment_in_band()
+
         config = request.get_json()
-        print("Received config:", config)  # Debug log
+        app.logger.debug("Received config: %s", config)
         
         # Validate required fields
-        required = ['type', 'input_path', 'output_path']
+        required = ['input_path', 'output_path']
         if not all(field in config for field in required):
             return jsonify({
                 "status": "error",
                 "message": f"Missing required fields: {required}"
             }), 400
 
-        # Initialize defaults
-        config.setdefault('params', {'beta': 1.0})
+        # Resolve the techniques (type/params, a pipeline, or config.yaml)
+        try:
+            steps = augmentation_steps(config)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        config['pipeline'] = steps
         
         # Verify input file exists
         if not os.path.exists(config['input_path']):
@@ -31,17 +141,36 @@ def augment():
                 "message": f"Input file not found: {config['input_path']}"
             }), 400
 
-        with mlflow.start_run():
-            result = apply_augmentation(config)
+        # Deterministic requests are served from the result cache when possible
+        output_path = config['output_path']
+        if not output_path.endswith('.npz'):
+            output_path += '.npz'
+        cache_key = None
+        if is_cacheable(steps):
+            cache_key = request_key(content_digest(config['input_path']), steps)
+
+        with batched_run() as (run, tracker):
+            cached = result_cache.get(cache_key, output_path) if cache_key else None
+            if cached is not None:
+                result = dict(cached, output_path=output_path)
+            else:
+                result = apply_augmentation(config)
+                if cache_key and result['status'] == 'success':
+                    result_cache.put(cache_key, result['output_path'], {
+                        k: v for k, v in result.items() if k != 'output_path'
+                    })
+            result['cache'] = dict(result_cache.stats(), hit=cached is not None, key=cache_key)
             
             if result['status'] == 'success':
-                mlflow.log_params({
-                    'augmentation_type': config['type'],
-                    'beta': config['params']['beta']
-                })
-                mlflow.log_metric('mix_ratio', result['mix_ratio'])
-                mlflow.log_artifact(config['input_path'], 'input')
-                mlflow.log_artifact(result['output_path'], 'output')
+                tracker.set_tag('cache_hit', str(cached is not None).lower())
+                log_augmentation(tracker, steps, result)
+
+                # Datasets are logged by reference unless full copies are requested
+                copy = bool(config.get('log_artifacts', False))
+                result['datasets'] = {
+                    'input': log_dataset(run, tracker, config['input_path'], 'input', copy),
+                    'output': log_dataset(run, tracker, result['output_path'], 'output', copy)
+                }
             
             return jsonify(result)
             
@@ -51,5 +180,13 @@ def augment():
             "message": str(e)
         }), 500
 
+@app.route('/health')
+def health():
+    return {'status': 'healthy'}, 200
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from common.digest import content_digest
+from common.disk_cache import DiskLRUCache
+from techniques import TECHNIQUES
+
+
+def request_key(input_digest, steps):
+    """
+    Cache key for an augmentation request
+
+    Steps are canonicalized (sorted keys, no whitespace) so equivalent
+    requests map to the same key regardless of how the JSON was written.
+    """
+    canonical_steps = []
+    for step in steps:
+        params = dict(step['params'])
+        canonical_steps.append({'type': step['type'], 'seed': params.pop('seed', None), 'params': params})
+    canonical = json.dumps({
+        'input': input_digest,
+        'steps': canonical_steps
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def is_cacheable(steps):
+    """
+    Whether the request produces the same output every time
+
+    Mixing techniques draw random partners, so they only qualify with an
+    explicit seed.
+    """
+    return all(
+        not TECHNIQUES[step['type']]['mixes'] or step['params'].get('seed') is not None
+        for step in steps
+    )
+
+
+def _copy_file(src, dst):
+    # Copy through a temp file so readers never see a partial output; the
+    # name is unique per thread since several processes may write one key
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ResultCache(DiskLRUCache):
+    """
+    On-disk LRU cache of augmentation outputs, bounded by total bytes
+
+    Entries live under ``cache_dir`` as ``<key>.npz``; their result
+    fields are kept in the shared index (see common.disk_cache). Outputs
+    are copied in and out rather than linked, so later writes to a
+    request's output path can't corrupt an entry.
+    """
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, key, output_path):
+        """
+        Materialize a cached output at output_path
+
+        Returns:
+            dict or None: Cached result fields, None on a miss
+        """
+        entry = self._touch(key)
+
+        try:
+            # Skip the copy when the output already holds these bytes
+            if entry is not None and not (
+                os.path.exists(output_path) and content_digest(output_path) == entry['sha256']
+            ):
+                _copy_file(self._entry_path(key), output_path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            entry = None
+
+        self._count(hit=entry is not None)
+        return None if entry is None else entry['result']
+
+    def put(self, key, output_path, result):
+        """Store a freshly written output, evicting least recently used entries"""
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            return
+        entry = {'bytes': size, 'sha256': content_digest(output_path), 'result': result}
+        _copy_file(output_path, self._entry_path(key))
+        self._record(key, entry)
+
+
+result_cache = ResultCache(
+    cache_dir=os.getenv('AUGMENTER_CACHE_DIR', '/app/data/augment_cache'),
+    max_bytes=int(os.getenv('AUGMENTER_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+)
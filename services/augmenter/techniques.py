@@ -2,65 +2,115 @@
 
 import numpy as np
 import os
-import random
+import time
+from contextlib import contextmanager
 
-def apply_augmentation(config):
+import yaml
+from scipy import ndimage
+from common.npz import iter_chunks, open_arrays, save_npz_chunks
+
+# Shared project config, its augmentation section is the default technique
+CONFIG_PATH = os.getenv("AUGMENTER_CONFIG", "/app/config.yaml")
+
+# Samples mixed per vectorized PuzzleMix step, bounds the float temporaries
+PUZZLEMIX_CHUNK_SIZE = 4096
+
+# Samples pushed through the technique pipeline per step when the input is in memory
+PIPELINE_CHUNK_SIZE = 4096
+
+# Samples read, augmented and written per step in streaming mode
+STREAM_CHUNK_SIZE = 1024
+
+# Samples per fused pass of the basic transform pipeline
+BASIC_CHUNK_SIZE = 256
+
+def apply_augmentation(config, arrays=None):
     """
-    Apply the specified augmentation technique to the input data
-    
+    Apply one technique, or a chain of them, to the input data
+
+    Every technique runs as a vectorized batch kernel over chunks of the
+    input, and chained techniques are fused per chunk, so the data is read
+    and written once whatever the chain length. Mixing techniques also mix
+    labels: the output then holds ``soft_labels`` (one column per entry of
+    ``label_classes``) next to ``labels``, the dominant class per sample.
+
     Args:
         config (dict): Configuration dictionary with keys:
             - type: Type of augmentation
             - params: Parameters for the augmentation
+            - pipeline: List of {'type', 'params'} applied in order (optional,
+              replaces type/params)
             - input_path: Path to input data
             - output_path: Path to save augmented data
+            - stream: Memory-map the input instead of loading it (optional)
+            - chunk_size: Samples per chunk (optional)
+        arrays (dict): In-memory 'images' and 'labels' to use instead of
+            input_path; the output then comes back in result['arrays']
+            instead of being written to output_path (optional)
             
     Returns:
         dict: Result with status and output path
     """
     try:
-        # Load the input data
-        input_data = np.load(config['input_path'])
-        images = input_data['images']
-        labels = input_data['labels']
-        
-        # Get augmentation parameters
-        aug_type = config['type']
-        params = config.get('params', {})
-        
-        # Apply the specified augmentation
-        if aug_type == 'puzzlemix':
-            augmented_images, mix_ratio = puzzlemix_augmentation(
-                images, 
-                beta=params.get('beta', 1.0)
-            )
-        elif aug_type == 'basic':
-            augmented_images, mix_ratio = basic_augmentation(
-                images,
-                rotate=params.get('rotate', 0),
-                flip=params.get('flip', False),
-                brightness=params.get('brightness', 0.0)
-            )
+        steps = augmentation_steps(config)
+        in_band = arrays is not None
+
+        # Load the input data (.npz archive or a directory of .npy files)
+        if not in_band:
+            arrays = open_arrays(config['input_path'])
+        images = arrays['images']
+        labels = np.asarray(arrays['labels'])
+        if config.get('stream', False):
+            default_chunk_size = STREAM_CHUNK_SIZE
         else:
-            return {
-                'status': 'error',
-                'message': f'Unknown augmentation type: {aug_type}'
-            }
-        
-        # Save the augmented data
-        os.makedirs(os.path.dirname(config['output_path']), exist_ok=True)
-        np.savez(
-            config['output_path'],
-            images=augmented_images,
-            labels=labels
+            images = np.asarray(images)
+            default_chunk_size = PIPELINE_CHUNK_SIZE
+        chunk_size = int(config.get('chunk_size', default_chunk_size))
+        n_images = len(images)
+        timings = {}
+
+        stages = plan_stages(steps, n_images, images.shape[1:])
+        image_chunks = (
+            stage_images(images, stages, slice(start, min(start + chunk_size, n_images)), timings)
+            for start in range(0, n_images, chunk_size)
         )
+        members = {'images': (images.shape, images.dtype, image_chunks)}
+
+        if any(TECHNIQUES[step['type']]['mixes'] for step in steps):
+            soft_labels, classes = mix_labels(labels, stages)
+            hard_labels = classes[soft_labels.argmax(axis=1)]
+            for name, array in (('labels', hard_labels), ('soft_labels', soft_labels), ('label_classes', classes)):
+                members[name] = (array.shape, array.dtype, iter_chunks(array, chunk_size))
+        else:
+            members['labels'] = (labels.shape, labels.dtype, iter_chunks(labels, chunk_size))
+
+        if in_band:
+            output = {name: _materialize(*member) for name, member in members.items()}
+            output_path = None
+        else:
+            # Save the augmented data, chunk by chunk as the pipeline produces it
+            os.makedirs(os.path.dirname(config['output_path']), exist_ok=True)
+            output_path = save_npz_chunks(config['output_path'], members)
+
+        # Each mixing stage keeps its mean ratio of the previous stage's content
+        step_ratios = [
+            float(plan['lam'].mean()) if plan is not None and technique['mixes'] else 1.0
+            for technique, plan in stages
+        ]
         
-        return {
+        result = {
             'status': 'success',
-            'mix_ratio': mix_ratio,
-            'output_path': config['output_path'],
-            'output_samples': len(augmented_images)
+            'mix_ratio': float(np.prod(step_ratios)),
+            'step_mix_ratios': step_ratios,
+            'steps': [step['type'] for step in steps],
+            'output_path': output_path,
+            'output_samples': n_images,
+            'chunk_size': chunk_size,
+            'op_timings_ms': timings
         }
+        if in_band:
+            result['arrays'] = output
+        return result
         
     except Exception as e:
         return {
@@ -68,62 +118,398 @@ def apply_augmentation(config):
             'message': str(e)
         }
 
-def puzzlemix_augmentation(images, beta=1.0):
+def _materialize(shape, dtype, chunks):
+    """Assemble chunks into one preallocated array"""
+    out = np.empty(shape, dtype=dtype)
+    offset = 0
+    for chunk in chunks:
+        out[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    return out
+
+def load_augmentation_config():
+    """Return the augmentation section of config.yaml as a step, None if unset"""
+    try:
+        with open(CONFIG_PATH) as f:
+            section = (yaml.safe_load(f) or {}).get('augmentation') or {}
+    except FileNotFoundError:
+        return None
+    if 'method' not in section:
+        return None
+    return {'type': section['method'], 'params': {k: v for k, v in section.items() if k != 'method'}}
+
+def augmentation_steps(config):
+    """
+    Resolve the techniques a request applies, in order
+
+    The request's ``pipeline`` wins, then its ``type`` and ``params``, then
+    the augmentation section of config.yaml (``method`` plus its params).
+
+    Returns:
+        list: {'type': name, 'params': dict} per step
+    """
+    if config.get('pipeline'):
+        steps = config['pipeline']
+    elif config.get('type'):
+        steps = [{'type': config['type'], 'params': config.get('params') or {}}]
+    else:
+        step = load_augmentation_config()
+        steps = [step] if step else []
+    if not steps:
+        raise ValueError('No augmentation requested: set type or pipeline')
+
+    resolved = []
+    for step in steps:
+        if step.get('type') not in TECHNIQUES:
+            raise ValueError(f"Unknown augmentation type: {step.get('type')}. Available: {sorted(TECHNIQUES)}")
+        resolved.append({'type': step['type'], 'params': dict(step.get('params') or {})})
+    return resolved
+
+def plan_stages(steps, n_images, image_shape):
+    """
+    Draw every step's random choices (partners, ratios, boxes) up front
+
+    Each step gets its own generator seeded from its ``seed`` param, so a
+    seeded step is reproducible wherever it sits in a chain. Mixing steps
+    need a partner, so they are skipped (plan None) for fewer than 2 samples.
+
+    Returns:
+        list: (technique entry, plan) per step
+    """
+    stages = []
+    for step in steps:
+        technique = TECHNIQUES[step['type']]
+        if technique['mixes'] and n_images < 2:
+            plan = None
+        else:
+            rng = np.random.default_rng(step['params'].get('seed'))
+            plan = technique['plan'](n_images, image_shape, step['params'], rng)
+        stages.append((technique, plan))
+    return stages
+
+def stage_images(images, stages, rows, timings):
+    """
+    Compute the output of every stage for the given rows
+
+    Partner samples are pushed through the earlier stages as well, so a
+    mix after a transform blends transformed images without materializing
+    the intermediate dataset. Each mixing stage doubles the rows read.
+
+    Args:
+        images (ndarray): Full input array (may be a memmap)
+        stages (list): Output of ``plan_stages``
+        rows (slice or ndarray): Samples to compute
+        timings (dict): Accumulates per-op wall time in milliseconds
+
+    Returns:
+        ndarray: Augmented rows in the input dtype
+    """
+    if not stages:
+        return images[rows]
+    technique, plan = stages[-1]
+    current = stage_images(images, stages[:-1], rows, timings)
+    if plan is None:
+        return current
+    partner = None
+    if technique['mixes']:
+        partner = stage_images(images, stages[:-1], plan['partners'][rows], timings)
+    return technique['kernel'](current, partner, plan, rows, timings)
+
+def mix_labels(labels, stages):
+    """
+    Mix labels with the same partners and ratios as the images
+
+    Args:
+        labels (ndarray): Class labels (N,) or soft labels (N, C)
+
+    Returns:
+        tuple: (soft labels (N, C) float32, class value of each column)
+    """
+    if labels.ndim == 2:
+        soft = labels.astype(np.float32)
+        classes = np.arange(labels.shape[1])
+    else:
+        classes, inverse = np.unique(labels, return_inverse=True)
+        soft = np.eye(len(classes), dtype=np.float32)[inverse]
+
+    for technique, plan in stages:
+        if technique['mixes'] and plan is not None:
+            lam = plan['lam'][:, None].astype(np.float32)
+            soft = soft * lam + soft[plan['partners']] * (1 - lam)
+    return soft, classes
+
+def _derangement(n, rng):
+    """
+    Draw a random partner index for every sample with no self-pairs
+
+    Args:
+        n (int): Number of samples
+        rng (np.random.Generator): Random generator
+
+    Returns:
+        ndarray: Partner indices, partner[i] != i for every i when n > 1
+    """
+    # Walking a random permutation as a single cycle guarantees no fixed points
+    order = rng.permutation(n)
+    partners = np.empty(n, dtype=np.intp)
+    partners[order] = np.roll(order, -1)
+    return partners
+
+def blend_batch(images, partner_images, plan, rows, timings=None):
+    """
+    Blend every sample with its partner pixel-wise (mixup and PuzzleMix)
+
+    Args:
+        images (ndarray): Chunk of samples
+        partner_images (ndarray): Their partners, same shape
+        plan (dict): Holds 'lam', the share each sample keeps
+        rows (slice or ndarray): Positions of the chunk in the dataset
+
+    Returns:
+        ndarray: Mixed chunk in the input dtype
+    """
+    with _timed({} if timings is None else timings, 'blend'):
+        # Ratios broadcast over every non-batch axis
+        lam = plan['lam'][rows].reshape((-1,) + (1,) * (images.ndim - 1))
+        mixed = images * lam
+        mixed += partner_images * (1 - lam)
+        return mixed.astype(images.dtype, copy=False)
+
+def mixup_plan(n_images, image_shape, params, rng):
+    """Partners and per-sample Beta(alpha, alpha) ratios for mixup"""
+    alpha = params.get('alpha', 0.2)
+    partners = _derangement(n_images, rng)
+    return {'partners': partners, 'lam': rng.beta(alpha, alpha, size=n_images)}
+
+def cutmix_plan(n_images, image_shape, params, rng):
+    """
+    Partners and one pasted box per sample for CutMix
+
+    Box area follows 1 - Beta(alpha, alpha); boxes clipped at the border
+    are smaller, so the stored ratio is recomputed from the actual area.
+    """
+    if len(image_shape) < 2:
+        raise ValueError(f'CutMix needs (N, H, W[, C]) images, got sample shape {image_shape}')
+    height, width = image_shape[:2]
+    alpha = params.get('alpha', 1.0)
+
+    partners = _derangement(n_images, rng)
+    lam = rng.beta(alpha, alpha, size=n_images)
+    cut = np.sqrt(1 - lam)
+    half_h = (height * cut).astype(int) // 2
+    half_w = (width * cut).astype(int) // 2
+    center_y = rng.integers(0, height, size=n_images)
+    center_x = rng.integers(0, width, size=n_images)
+
+    boxes = np.stack([
+        np.clip(center_y - half_h, 0, height),
+        np.clip(center_y + half_h, 0, height),
+        np.clip(center_x - half_w, 0, width),
+        np.clip(center_x + half_w, 0, width)
+    ], axis=1)
+    area = (boxes[:, 1] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 2])
+    return {'partners': partners, 'lam': 1 - area / (height * width), 'boxes': boxes}
+
+def cutmix_batch(images, partner_images, plan, rows, timings=None):
+    """Paste each partner's box into its sample with one broadcast mask"""
+    with _timed({} if timings is None else timings, 'cutmix'):
+        y1, y2, x1, x2 = (plan['boxes'][rows, i][:, None, None] for i in range(4))
+        ys = np.arange(images.shape[1])[None, :, None]
+        xs = np.arange(images.shape[2])[None, None, :]
+        mask = (ys >= y1) & (ys < y2) & (xs >= x1) & (xs < x2)
+        # Channels (if any) share the spatial mask
+        mask = mask.reshape(mask.shape + (1,) * (images.ndim - 3))
+        return np.where(mask, partner_images, images)
+
+def puzzlemix_plan(n_images, beta=1.0, rng=None):
+    """
+    Draw PuzzleMix partners and per-sample mix ratios in one shot
+
+    Args:
+        n_images (int): Number of samples
+        beta (float): Beta parameter for mixing (higher = more mixing)
+        rng (np.random.Generator): Random generator, seed it for reproducible runs
+
+    Returns:
+        tuple: (partner indices, mix ratios)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    partners = _derangement(n_images, rng)
+    mix_ratios = rng.beta(beta, beta, size=n_images)
+    return partners, mix_ratios
+
+def _puzzlemix_stage_plan(n_images, image_shape, params, rng):
+    partners, mix_ratios = puzzlemix_plan(n_images, params.get('beta', 1.0), rng)
+    return {'partners': partners, 'lam': mix_ratios}
+
+def puzzlemix_augmentation(images, beta=1.0, rng=None, chunk_size=PUZZLEMIX_CHUNK_SIZE):
     """
     Implement PuzzleMix augmentation
-    
+
+    Every image is mixed with a partner drawn from a random permutation
+    using its own Beta(beta, beta) ratio. Mixing runs over chunks of the
+    batch with NumPy broadcasting instead of a per-sample loop.
+
     Args:
         images (ndarray): Input images
         beta (float): Beta parameter for mixing (higher = more mixing)
-        
+        rng (np.random.Generator): Random generator, seed it for reproducible runs
+        chunk_size (int): Number of samples mixed per vectorized step
+
     Returns:
-        tuple: (augmented images, mix ratio)
+        tuple: (augmented images, mean mix ratio)
     """
-    # Calculate a dynamic mix ratio based on beta
-    # This ensures mix_ratio isn't always 1.0
-    mix_ratio = np.random.beta(beta, beta)
-    
-    # Get the number of images
     n_images = images.shape[0]
-    
-    # Create augmented images
-    augmented_images = np.copy(images)
-    
-    # For each image, mix it with another random image
-    for i in range(n_images):
-        # Select a random image to mix with
-        j = random.randint(0, n_images-1)
-        while j == i:  # Ensure we don't mix with the same image
-            j = random.randint(0, n_images-1)
-            
-        # Mix the images
-        augmented_images[i] = images[i] * mix_ratio + images[j] * (1 - mix_ratio)
-    
-    return augmented_images, float(mix_ratio)
+    if n_images < 2:
+        return np.copy(images), 1.0
+
+    partners, mix_ratios = puzzlemix_plan(n_images, beta, rng)
+    plan = {'partners': partners, 'lam': mix_ratios}
+
+    augmented_images = np.empty_like(images)
+    for start in range(0, n_images, chunk_size):
+        rows = slice(start, min(start + chunk_size, n_images))
+        augmented_images[rows] = blend_batch(images[rows], images[partners[rows]], plan, rows)
+
+    return augmented_images, float(mix_ratios.mean())
 
-def basic_augmentation(images, rotate=0, flip=False, brightness=0.0):
+def _basic_batch(images, partner_images, plan, rows, timings=None):
+    augmented, _ = basic_augmentation(
+        images,
+        rotate=plan.get('rotate', 0),
+        flip=plan.get('flip', False),
+        brightness=plan.get('brightness', 0.0),
+        contrast=plan.get('contrast', 0.0),
+        timings=timings
+    )
+    return augmented
+
+@contextmanager
+def _timed(timings, name):
+    """Accumulate the wall time of a block into timings[name] (milliseconds)"""
+    start = time.perf_counter()
+    yield
+    timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+def _flip_axes(flip):
+    """Map the flip parameter to spatial axes (1 = vertical, 2 = horizontal)"""
+    if flip in (False, None, 'none'):
+        return ()
+    if flip in (True, 'horizontal'):
+        return (2,)
+    if flip == 'vertical':
+        return (1,)
+    if flip == 'both':
+        return (1, 2)
+    raise ValueError(f'Unknown flip mode: {flip}')
+
+def _geometry_view(images, quarter_turns, flip_axes):
+    """Compose rot90 and flips as a strided view, nothing is copied"""
+    view = images
+    if quarter_turns:
+        view = np.rot90(view, quarter_turns, axes=(1, 2))
+    for axis in flip_axes:
+        view = np.flip(view, axis=axis)
+    return view
+
+def basic_augmentation(images, rotate=0, flip=False, brightness=0.0, contrast=0.0,
+                       out=None, chunk_size=BASIC_CHUNK_SIZE, timings=None):
     """
     Implement basic augmentation techniques
-    
+
+    All ops run in one pass over the data, chunk by chunk, writing into a
+    preallocated output buffer. Quarter-turn rotations and flips are fused
+    into a single strided copy; other angles are interpolated straight into
+    the output. Brightness, contrast and clipping then run in place.
+
     Args:
-        images (ndarray): Input images
-        rotate (int): Rotation angle in degrees
-        flip (bool): Whether to flip images horizontally
+        images (ndarray): Input images, (N, H, W) or (N, H, W, C)
+        rotate (float): Rotation angle in degrees, counter-clockwise
+        flip (bool or str): True/'horizontal', 'vertical' or 'both'
         brightness (float): Brightness adjustment factor
-        
+        contrast (float): Contrast adjustment factor
+        out (ndarray): Output buffer shaped like images (optional)
+        chunk_size (int): Number of samples transformed per step
+        timings (dict): Accumulates per-op wall time in milliseconds (optional)
+
     Returns:
         tuple: (augmented images, mix ratio)
     """
-    # Copy the images
-    augmented_images = np.copy(images)
-    
-    # Apply brightness adjustment
-    if brightness != 0.0:
-        augmented_images = augmented_images * (1 + brightness)
-        augmented_images = np.clip(augmented_images, 0, 1)
-    
-    # For simplicity, we're returning a random mix ratio between 0.5 and 1.0
-    # In a real implementation, this would be calculated based on the actual transformations
-    mix_ratio = random.uniform(0.5, 1.0)
-    
-    return augmented_images, float(mix_ratio)
\ No newline at end of file
+    if out is None:
+        out = np.empty_like(images)
+    if timings is None:
+        timings = {}
+
+    flip_axes = _flip_axes(flip)
+    angle = float(rotate) % 360
+    if (angle or flip_axes) and images.ndim < 3:
+        raise ValueError(f'Rotation and flips need (N, H, W[, C]) images, got shape {images.shape}')
+
+    # rot90 views only keep the shape for square images (or half turns)
+    quarter_turns = 0
+    interpolate = False
+    if angle:
+        if angle % 90 == 0 and (angle == 180 or images.shape[1] == images.shape[2]):
+            quarter_turns = int(angle // 90)
+        else:
+            interpolate = True
+
+    # Integer images are adjusted in a float scratch buffer and cast back on store
+    photometric = brightness != 0.0 or contrast != 0.0
+    float_work = np.issubdtype(out.dtype, np.floating) or not photometric
+    if float_work:
+        low, high = 0, 1
+        scratch = None
+    else:
+        low, high = np.iinfo(out.dtype).min, np.iinfo(out.dtype).max
+        scratch = np.empty((min(chunk_size, len(images)),) + images.shape[1:], dtype=np.float32)
+    sample_axes = tuple(range(1, images.ndim))
+
+    for start in range(0, len(images), chunk_size):
+        stop = min(start + chunk_size, len(images))
+        work = out[start:stop] if float_work else scratch[:stop - start]
+
+        with _timed(timings, 'geometry'):
+            if interpolate:
+                # Flipping first mirrors the rotation direction
+                view = _geometry_view(images[start:stop], 0, flip_axes)
+                signed_angle = -angle if len(flip_axes) == 1 else angle
+                ndimage.rotate(view, signed_angle, axes=(2, 1), reshape=False,
+                               output=work, order=1, mode='nearest')
+            else:
+                np.copyto(work, _geometry_view(images[start:stop], quarter_turns, flip_axes),
+                          casting='unsafe')
+
+        if contrast != 0.0:
+            with _timed(timings, 'contrast'):
+                mean = work.mean(axis=sample_axes, keepdims=True)
+                np.subtract(work, mean, out=work)
+                np.multiply(work, 1 + contrast, out=work)
+                np.add(work, mean, out=work)
+
+        if brightness != 0.0:
+            with _timed(timings, 'brightness'):
+                np.multiply(work, 1 + brightness, out=work)
+
+        if photometric:
+            with _timed(timings, 'clip'):
+                np.clip(work, low, high, out=work)
+
+        if not float_work:
+            with _timed(timings, 'store'):
+                np.rint(work, out=work)
+                np.copyto(out[start:stop], work, casting='unsafe')
+
+    # Basic transforms don't blend samples, every output is fully its source
+    return out, 1.0
+
+# Technique registry: 'plan' draws per-sample choices for the whole dataset
+# up front, 'kernel' applies them to a chunk, 'mixes' marks techniques that
+# blend each sample with a partner (and therefore mix labels)
+TECHNIQUES = {
+    'mixup': {'plan': mixup_plan, 'kernel': blend_batch, 'mixes': True},
+    'cutmix': {'plan': cutmix_plan, 'kernel': cutmix_batch, 'mixes': True},
+    'puzzlemix': {'plan': _puzzlemix_stage_plan, 'kernel': blend_batch, 'mixes': True},
+    'basic': {'plan': lambda n_images, image_shape, params, rng: params, 'kernel': _basic_batch, 'mixes': False}
+}
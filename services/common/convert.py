@@ -0,0 +1,249 @@
+"""Chunked CSV -> .npz/.npy conversion with dtype downcasting"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow is optional, pandas' C parser is the fallback
+    pa_csv = None
+
+from common.labels import CSV_LABEL_SCALE, encode_csv_targets
+from common.npz import save_npz_chunks
+
+# Rows parsed (and written) per step
+CSV_CHUNK_SIZE = 65536
+
+# npz: uncompressed, memory-mappable; npz_compressed: deflated;
+# npy: a directory holding images.npy and labels.npy
+OUTPUT_FORMATS = ('npz', 'npz_compressed', 'npy')
+
+
+def count_rows(path):
+    """Data rows in a CSV (lines minus the header), counted without parsing"""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def iter_csv_chunks(path, target='target', chunk_size=CSV_CHUNK_SIZE, engine='auto', rows=None):
+    """
+    Yield (features, labels) float64 arrays of roughly chunk_size rows
+
+    Args:
+        engine (str): 'pyarrow' (streaming reader, no DataFrame in between),
+            any pandas engine, or 'auto' to use pyarrow when installed and
+            there are cores for its parser threads
+        rows (int): Row count if already known, sizes pyarrow's blocks
+    """
+    if engine == 'auto':
+        engine = 'pyarrow' if pa_csv is not None and (os.cpu_count() or 1) > 1 else 'c'
+
+    if engine != 'pyarrow':
+        for chunk in pd.read_csv(path, chunksize=chunk_size, engine=engine):
+            if target not in chunk.columns:
+                raise ValueError(f"'{target}' column not found in CSV. Available columns: {chunk.columns.tolist()}")
+            yield chunk.drop(columns=target).to_numpy(dtype=np.float64), chunk[target].to_numpy(dtype=np.float64)
+        return
+
+    if pa_csv is None:
+        raise ImportError('The pyarrow engine needs pyarrow installed')
+    # pyarrow batches by bytes, size blocks to about chunk_size rows
+    rows = count_rows(path) if rows is None else rows
+    block_size = max(1 << 20, int(os.path.getsize(path) / max(rows, 1) * chunk_size))
+    reader = pa_csv.open_csv(path, read_options=pa_csv.ReadOptions(block_size=block_size))
+    names = reader.schema.names
+    if target not in names:
+        raise ValueError(f"'{target}' column not found in CSV. Available columns: {names}")
+    label_index = names.index(target)
+    for batch in reader:
+        columns = [column.to_numpy().astype(np.float64, copy=False) for column in batch.columns]
+        labels = columns.pop(label_index)
+        yield np.column_stack(columns), labels
+
+
+def _label_dtype(labels):
+    """Smallest integer dtype holding integral labels, float32 otherwise"""
+    if len(labels) and np.array_equal(labels, np.round(labels)):
+        low, high = int(labels.min()), int(labels.max())
+        return np.result_type(np.min_scalar_type(low), np.min_scalar_type(high))
+    return np.dtype(np.float32)
+
+
+def convert_csv_to_npz(input_path, output_path, target='target', shape=None, fmt='npz',
+                       dtype='auto', label_scale=None, chunk_size=CSV_CHUNK_SIZE, engine='auto'):
+    """
+    Convert a CSV of feature columns plus a target column to arrays on disk
+
+    The CSV is parsed chunk by chunk into a float32 scratch memmap (float64
+    if requested), so memory stays bounded by chunk_size. With
+    dtype='auto' features that are all integers in [0, 255] are stored as
+    uint8, everything else as float32. Labels use the smallest integer
+    dtype that holds them, or float32 when they aren't integral.
+
+    Args:
+        input_path (str): CSV file with a header row
+        output_path (str): .npz path, or a directory for fmt='npy'
+        target (str): Label column
+        shape (tuple): Per-sample shape, e.g. (20, 1); None keeps rows flat
+        fmt (str): One of OUTPUT_FORMATS
+        dtype (str): 'auto', 'uint8', 'float32' or 'float64'
+        label_scale (float): Multiply labels by this and truncate to int (optional)
+        chunk_size (int): Rows parsed per step
+        engine (str): CSV parser, see iter_csv_chunks
+
+    Returns:
+        dict: Output path, shapes, dtypes and throughput
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {fmt}. Available: {list(OUTPUT_FORMATS)}")
+    if dtype not in ('auto', 'uint8', 'float32', 'float64'):
+        raise ValueError(f"Unsupported dtype: {dtype}")
+
+    start = time.perf_counter()
+    expected_rows = count_rows(input_path)
+    scratch_dtype = np.float64 if dtype == 'float64' else np.float32
+    out_dir = output_path if fmt == 'npy' else (os.path.dirname(output_path) or '.')
+    os.makedirs(out_dir, exist_ok=True)
+    scratch_path = os.path.join(out_dir, f'.{os.path.basename(output_path.rstrip(os.sep))}.images.tmp.npy')
+
+    scratch = None
+    labels = []
+    rows = 0
+    fits_uint8 = True
+    try:
+        for features, chunk_labels in iter_csv_chunks(input_path, target, chunk_size, engine, expected_rows):
+            if scratch is None:
+                sample_shape = tuple(shape) if shape else (features.shape[1],)
+                if int(np.prod(sample_shape)) != features.shape[1]:
+                    raise ValueError(f"Cannot reshape {features.shape[1]} features per row to {sample_shape}")
+                scratch = np.lib.format.open_memmap(
+                    scratch_path, mode='w+', dtype=scratch_dtype, shape=(expected_rows,) + sample_shape
+                )
+            if rows + len(features) > expected_rows:
+                raise ValueError(f"CSV has more rows than the {expected_rows} lines counted")
+
+            if fits_uint8 and dtype == 'auto':
+                fits_uint8 = (features.min(initial=0) >= 0 and features.max(initial=0) <= 255
+                              and np.array_equal(features, np.round(features)))
+            scratch[rows:rows + len(features)] = features.reshape((-1,) + sample_shape)
+            labels.append(chunk_labels)
+            rows += len(features)
+
+        if scratch is None:
+            raise ValueError(f"No rows found in {input_path}")
+
+        labels = np.concatenate(labels)
+        if label_scale is not None:
+            labels = encode_csv_targets(labels, label_scale)
+        labels = labels.astype(_label_dtype(labels))
+
+        if dtype == 'auto':
+            images_dtype = np.dtype(np.uint8 if fits_uint8 else np.float32)
+        else:
+            images_dtype = np.dtype(dtype)
+        # Blank lines are counted but not parsed, drop the unused tail
+        images = scratch[:rows]
+
+        if fmt == 'npy':
+            images_path = os.path.join(output_path, 'images.npy')
+            if images_dtype == scratch.dtype and rows == expected_rows:
+                scratch.flush()
+                del scratch, images
+                os.replace(scratch_path, images_path)
+            else:
+                out = np.lib.format.open_memmap(images_path, mode='w+', dtype=images_dtype, shape=images.shape)
+                for i in range(0, rows, chunk_size):
+                    out[i:i + chunk_size] = images[i:i + chunk_size]
+                out.flush()
+                del out
+            np.save(os.path.join(output_path, 'labels.npy'), labels)
+            written = output_path
+            bytes_out = sum(os.path.getsize(os.path.join(output_path, name)) for name in ('images.npy', 'labels.npy'))
+        else:
+            written = save_npz_chunks(output_path, {
+                'images': (images.shape, images_dtype,
+                           (images[i:i + chunk_size] for i in range(0, rows, chunk_size))),
+                'labels': (labels.shape, labels.dtype, [labels])
+            }, compress=fmt == 'npz_compressed')
+            bytes_out = os.path.getsize(written)
+    finally:
+        scratch = images = None
+        if os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+    seconds = time.perf_counter() - start
+    bytes_in = os.path.getsize(input_path)
+    return {
+        'output_path': written,
+        'format': fmt,
+        'rows': rows,
+        'sample_shape': list(sample_shape),
+        'images_dtype': str(images_dtype),
+        'labels_dtype': str(labels.dtype),
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out,
+        'seconds': seconds,
+        'rows_per_sec': rows / seconds if seconds else float('inf'),
+        'mb_per_sec': bytes_in / 1e6 / seconds if seconds else float('inf')
+    }
+
+
+def _parse_shape(value):
+    return tuple(int(dim) for dim in value.split(',')) if value else None
+
+
+def main(argv=None):
+    # Defaults reproduce the HyperK sample conversion used by test_pipeline.sh
+    parser = argparse.ArgumentParser(description='Convert a CSV of features plus a target column to .npz/.npy')
+    parser.add_argument('--input', default='/app/data/hyperk_sample.csv')
+    parser.add_argument('--output', default='/app/data/hyperk_sample.npz')
+    parser.add_argument('--target', default='target', help='Label column')
+    parser.add_argument('--shape', type=_parse_shape, default=(20, 1),
+                        help="Per-sample shape, e.g. '20,1'; empty keeps rows flat")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='npz')
+    parser.add_argument('--dtype', choices=('auto', 'uint8', 'float32', 'float64'), default='auto')
+    parser.add_argument('--label-scale', type=float, default=CSV_LABEL_SCALE, help='Labels become int(label * scale); 0 keeps them')
+    parser.add_argument('--chunk-size', type=int, default=CSV_CHUNK_SIZE)
+    parser.add_argument('--engine', default='auto', help="'pyarrow', 'c', 'python' or 'auto'")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.input):
+        print(f"❌ Error: Input file {args.input} does not exist")
+        sys.exit(1)
+    try:
+        stats = convert_csv_to_npz(
+            args.input, args.output,
+            target=args.target,
+            shape=args.shape,
+            fmt=args.format,
+            dtype=args.dtype,
+            label_scale=args.label_scale or None,
+            chunk_size=args.chunk_size,
+            engine=args.engine
+        )
+    except Exception as e:
+        print(f"❌ Conversion failed: {str(e)}")
+        sys.exit(1)
+
+    print(f"✅ Conversion successful. Saved to {stats['output_path']}")
+    print(f"   {stats['rows']} rows of {stats['sample_shape']} {stats['images_dtype']}, "
+          f"labels {stats['labels_dtype']}")
+    print(f"   {stats['bytes_in']} -> {stats['bytes_out']} bytes in {stats['seconds']:.2f}s "
+          f"({stats['rows_per_sec']:.0f} rows/s, {stats['mb_per_sec']:.1f} MB/s)")
+    return stats
+
+
+if __name__ == '__main__':
+    main()
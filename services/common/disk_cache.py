@@ -0,0 +1,124 @@
+import fcntl
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class DiskLRUCache:
+    """
+    Base for on-disk caches with a shared LRU index, bounded by total bytes
+
+    Entries live under ``cache_dir`` next to an ``index.json`` holding
+    each key's fields (at least ``bytes``) in LRU order, so a cache
+    survives restarts. The index is re-read and written under a file
+    lock, so several server processes can share one cache; hit/miss
+    counters are per process.
+
+    Subclasses say where an entry lives (``_entry_path``), how to tell it
+    is complete (``_entry_exists``) and how to delete it (``_remove_entry``).
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load_index()
+
+    def _entry_path(self, key):
+        raise NotImplementedError
+
+    def _entry_exists(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def _remove_entry(self, key):
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            entries = []
+        # Keep only entries whose files survived
+        self._entries = OrderedDict(
+            (key, entry) for key, entry in entries if self._entry_exists(key)
+        )
+
+    @contextmanager
+    def _locked_index(self):
+        # Other processes may have changed the index since we last saw it
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock, open(os.path.join(self.cache_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._load_index()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = self._index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(tmp, self._index_path)
+
+    def _total_bytes(self):
+        return sum(entry['bytes'] for entry in self._entries.values())
+
+    def _touch(self, key):
+        """Mark key most recently used, return its fields (None on a miss)"""
+        with self._locked_index():
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._save_index()
+        return entry
+
+    def _record(self, key, entry, keep_newest=False):
+        """
+        Index an entry whose files are in place, then evict least recently
+        used entries until the cache fits max_bytes
+
+        With keep_newest the new entry survives even if it alone is over
+        budget (callers still hold it open).
+        """
+        with self._locked_index():
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while self._total_bytes() > self.max_bytes and len(self._entries) > (1 if keep_newest else 0):
+                evicted, _ = self._entries.popitem(last=False)
+                self._remove_entry(evicted)
+                self.evictions += 1
+            self._save_index()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Hit/miss counters (this process) and current usage (shared)"""
+        with self._locked_index():
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes(),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,27 @@
+"""Gunicorn settings shared by every service, tuned per service through env vars"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Worker processes; CPU-bound endpoints scale with these, not with threads
+workers = int(os.getenv('GUNICORN_WORKERS', os.cpu_count() or 1))
+
+# Threads per worker (gunicorn switches to the gthread worker when > 1)
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+# Training and augmentation requests can legitimately run for minutes
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 300))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Import the app (sklearn, shap, cv2, mlflow) once in the master and fork
+# workers from it, instead of paying the import in every worker
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Recycle workers after this many requests to cap slow leaks (0 disables)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
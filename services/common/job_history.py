@@ -0,0 +1,51 @@
+"""Bounded, thread-safe status records of background jobs"""
+
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class JobHistory:
+    """
+    Status records of the most recent ``max_history`` jobs
+
+    Each record is a dict of fields (status, result, error, timestamps)
+    under a generated job id; adding one past the bound drops the oldest.
+    Job queues update records as their jobs move between states, callers
+    poll them by id.
+    """
+
+    def __init__(self, max_history=1000):
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_history = max_history
+
+    def add(self, **fields):
+        """Record a new job and return its id"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = fields
+            while len(self._jobs) > self._max_history:
+                self._jobs.popitem(last=False)
+        return job_id
+
+    def set(self, job_id, **fields):
+        """Update a job's record"""
+        with self._lock:
+            # Old jobs may already have been trimmed from the history
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def status(self, job_id):
+        """Return a copy of the job record, None for unknown ids"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, job_id=job_id) if job is not None else None
+
+    def counts(self):
+        """Number of recorded jobs in each status"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return counts
@@ -0,0 +1,15 @@
+import numpy as np
+
+# common.convert stores a CSV target t as int(t * 4) by default, so the
+# HyperK sample's targets 0-4 are on disk as 0, 4, 8, 12, 16
+CSV_LABEL_SCALE = 4
+
+
+def encode_labels(labels):
+    """Class codes from stored (.npz/.npy or in-band) labels, which are already integral"""
+    return np.rint(np.asarray(labels)).astype(np.int64)
+
+
+def encode_csv_targets(targets, label_scale=CSV_LABEL_SCALE):
+    """Class codes from raw CSV targets, truncated the way common.convert stores them"""
+    return (np.asarray(targets, dtype=np.float64) * label_scale).astype(np.int64)
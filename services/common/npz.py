@@ -0,0 +1,132 @@
+import os
+import struct
+import threading
+import zipfile
+
+import numpy as np
+
+# Size of the fixed part of a ZIP local file header
+_LOCAL_HEADER_SIZE = 30
+
+
+def save_npz_chunks(path, members, compress=False):
+    """
+    Write an .npz archive incrementally, one chunk at a time
+
+    Produces the same layout as ``np.savez`` so readers can keep using
+    ``np.load``. The archive is written to a temporary file named per
+    writer and moved into place, so the output may safely replace a
+    memory-mapped input and concurrent writers of one path never share a
+    partial file (the last one to finish wins).
+
+    Args:
+        path (str): Output path, '.npz' is appended if missing
+        members (dict): Array name -> (shape, dtype, iterable of chunks)
+        compress (bool): Deflate members like ``np.savez_compressed``
+            (they can then no longer be memory-mapped)
+
+    Returns:
+        str: Path written
+    """
+    if not path.endswith('.npz'):
+        path = path + '.npz'
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', compression=compression, allowZip64=True) as zf:
+            for name, (shape, dtype, chunks) in members.items():
+                dtype = np.dtype(dtype)
+                with zf.open(name + '.npy', 'w', force_zip64=True) as fh:
+                    np.lib.format.write_array_header_2_0(fh, {
+                        'descr': np.lib.format.dtype_to_descr(dtype),
+                        'fortran_order': False,
+                        'shape': tuple(shape)
+                    })
+                    for chunk in chunks:
+                        fh.write(np.ascontiguousarray(chunk, dtype=dtype))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return path
+
+
+def _memmap_npz_member(path, name):
+    """
+    Memory-map one array stored uncompressed inside an .npz archive
+
+    Args:
+        path (str): Path to the .npz file
+        name (str): Array name (without the .npy suffix)
+
+    Returns:
+        np.memmap or None: Read-only view, None if the member is compressed
+    """
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(path, 'rb') as f:
+        # Skip the local header to reach the raw .npy bytes
+        f.seek(info.header_offset)
+        header = f.read(_LOCAL_HEADER_SIZE)
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len)
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode='r',
+        offset=offset,
+        shape=shape,
+        order='F' if fortran_order else 'C'
+    )
+
+
+def open_arrays(path, names=('images', 'labels')):
+    """
+    Open arrays from disk without reading them into memory
+
+    Supports a directory of .npy files (``<dir>/images.npy``) and .npz
+    archives. Uncompressed .npz members are memory-mapped; compressed
+    members can't be and are loaded in full.
+
+    Args:
+        path (str): Directory of .npy files or .npz archive
+        names (tuple): Array names to open
+
+    Returns:
+        dict: Array name -> memmap (or ndarray fallback)
+    """
+    if os.path.isdir(path):
+        return {
+            name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            for name in names
+        }
+
+    arrays = {}
+    for name in names:
+        array = _memmap_npz_member(path, name)
+        if array is None:
+            with np.load(path) as data:
+                array = data[name]
+        arrays[name] = array
+    return arrays
+
+
+def iter_chunks(array, chunk_size):
+    """Yield consecutive row slices of at most chunk_size samples"""
+    for start in range(0, len(array), chunk_size):
+        yield array[start:start + chunk_size]
@@ -0,0 +1,224 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from mlflow.entities import DatasetInput, InputTag, Metric, Param, RunStatus, RunTag
+from mlflow.exceptions import MlflowException
+from mlflow.models import Model
+from mlflow.tracking import MlflowClient
+from mlflow.tracking.context.registry import resolve_tags
+from mlflow.tracking.default_experiment import DEFAULT_EXPERIMENT_ID
+from mlflow.utils.mlflow_tags import MLFLOW_PARENT_RUN_ID
+
+# log_batch request limits of the tracking server
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_TAGS_PER_BATCH = 100
+
+# Artifact uploads run concurrently on a pool shared by all loggers
+_UPLOAD_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MLFLOW_UPLOAD_WORKERS", 4)),
+    thread_name_prefix="mlflow-upload"
+)
+
+
+def _is_transient(error):
+    """Client errors (4xx) won't succeed on retry, anything else might"""
+    if isinstance(error, MlflowException):
+        return error.get_http_status_code() >= 500
+    return True
+
+
+def with_retries(fn, *args, retries=3, backoff=0.5):
+    """Call fn(*args), retrying transient failures with exponential backoff"""
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt == retries or not _is_transient(e):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+class BatchLogger:
+    """
+    Buffers params, metrics and tags for one run and sends them with
+    ``MlflowClient.log_batch`` on flush; artifacts upload in the background
+
+    Methods mirror the fluent ``mlflow.log_*`` API so call sites read the
+    same. Nothing reaches the server until ``flush``.
+    """
+
+    def __init__(self, run_id, client=None, retries=3):
+        self.run_id = run_id
+        self.client = client or MlflowClient()
+        self.retries = retries
+        self._params = {}
+        self._metrics = []
+        self._tags = {}
+        self._uploads = []
+        self._inputs = []
+        self._staging = None
+
+    def log_param(self, key, value):
+        self._params[key] = str(value)
+
+    def log_params(self, params):
+        for key, value in params.items():
+            self.log_param(key, value)
+
+    def log_metric(self, key, value, step=0):
+        self._metrics.append(Metric(key, float(value), int(time.time() * 1000), step))
+
+    def log_metrics(self, metrics, step=0):
+        for key, value in metrics.items():
+            self.log_metric(key, value, step)
+
+    def set_tag(self, key, value):
+        self._tags[key] = str(value)
+
+    def set_tags(self, tags):
+        for key, value in tags.items():
+            self.set_tag(key, value)
+
+    def log_input(self, dataset, context=None):
+        """Record an mlflow.entities.Dataset as a run input"""
+        tags = [InputTag("mlflow.data.context", context)] if context else []
+        self._inputs.append(DatasetInput(dataset, tags))
+
+    def staging_path(self, filename):
+        """Path in a scratch directory that lives until the next flush"""
+        if self._staging is None:
+            self._staging = tempfile.mkdtemp(prefix="mlflow-batch-")
+        return os.path.join(self._staging, filename)
+
+    def log_artifact(self, local_path, artifact_path=None):
+        """Start uploading a file now, flush waits for it to finish"""
+        self._uploads.append(_UPLOAD_POOL.submit(
+            with_retries, self.client.log_artifact, self.run_id, local_path, artifact_path,
+            retries=self.retries
+        ))
+
+    def log_dict(self, dictionary, artifact_file):
+        """Upload a dict as a JSON artifact"""
+        artifact_dir, filename = os.path.split(artifact_file)
+        local_path = self.staging_path(filename)
+        with open(local_path, "w") as f:
+            json.dump(dictionary, f, indent=2)
+        self.log_artifact(local_path, artifact_dir or None)
+
+    def log_model(self, model, artifact_path, flavor=None):
+        """
+        Save a model locally and upload it under artifact_path of this run
+
+        Stands in for ``mlflow.<flavor>.log_model``, which logs to the
+        process-wide fluent active run and so can't be used from worker
+        threads running several jobs at once.
+
+        Args:
+            model: Model object the flavor can save
+            artifact_path (str): Run-relative directory, e.g. "model"
+            flavor (module): MLflow flavor with save_model, mlflow.sklearn by default
+        """
+        if flavor is None:
+            import mlflow.sklearn
+            flavor = mlflow.sklearn
+        local_path = self.staging_path(artifact_path)
+        # MLmodel records the run like log_model does (the evaluator's cache keys on it)
+        flavor.save_model(model, local_path, mlflow_model=Model(artifact_path=artifact_path, run_id=self.run_id))
+        self._uploads.append(_UPLOAD_POOL.submit(
+            with_retries, self.client.log_artifacts, self.run_id, local_path, artifact_path,
+            retries=self.retries
+        ))
+
+    def _send_batch(self, params, metrics, tags):
+        self.client.log_batch(self.run_id, metrics=metrics, params=params, tags=tags)
+
+    def flush(self):
+        """Send buffered values in as few log_batch calls as possible and wait for uploads"""
+        params = [Param(key, value) for key, value in self._params.items()]
+        tags = [RunTag(key, value) for key, value in self._tags.items()]
+        metrics = self._metrics
+        inputs = self._inputs
+        self._params, self._tags, self._metrics, self._inputs = {}, {}, [], []
+        upload_errors = []
+
+        try:
+            if inputs:
+                with_retries(self.client.log_inputs, self.run_id, inputs, retries=self.retries)
+            while params or metrics or tags:
+                with_retries(
+                    self._send_batch,
+                    params[:MAX_PARAMS_PER_BATCH],
+                    metrics[:MAX_METRICS_PER_BATCH],
+                    tags[:MAX_TAGS_PER_BATCH],
+                    retries=self.retries
+                )
+                params = params[MAX_PARAMS_PER_BATCH:]
+                metrics = metrics[MAX_METRICS_PER_BATCH:]
+                tags = tags[MAX_TAGS_PER_BATCH:]
+        finally:
+            # Staged files must outlive their uploads
+            uploads, self._uploads = self._uploads, []
+            for upload in uploads:
+                try:
+                    upload.result()
+                except Exception as e:
+                    upload_errors.append(e)
+            if self._staging is not None:
+                shutil.rmtree(self._staging, ignore_errors=True)
+                self._staging = None
+
+        if upload_errors:
+            raise upload_errors[0]
+
+
+def _experiment_id(client):
+    """Experiment for new runs, from the same variables mlflow.start_run reads"""
+    experiment_id = os.getenv("MLFLOW_EXPERIMENT_ID")
+    if experiment_id:
+        return experiment_id
+    name = os.getenv("MLFLOW_EXPERIMENT_NAME")
+    if not name:
+        return DEFAULT_EXPERIMENT_ID
+    experiment = client.get_experiment_by_name(name)
+    if experiment is not None:
+        return experiment.experiment_id
+    try:
+        return client.create_experiment(name)
+    except MlflowException:
+        # Another worker created it first
+        return client.get_experiment_by_name(name).experiment_id
+
+
+@contextmanager
+def batched_run(parent_run_id=None):
+    """
+    Create a run and yield (run, BatchLogger); flush and end it on exit
+
+    The run is created and ended through ``MlflowClient`` and never
+    becomes the fluent active run, which is global to the process and
+    would mix up jobs running on different threads. Inside the block, log
+    through the BatchLogger only (``log_model`` for models), not through
+    ``mlflow.log_*`` or ``mlflow.<flavor>.log_model``.
+
+    Args:
+        parent_run_id (str): Make this a nested run of that run (optional)
+    """
+    client = MlflowClient()
+    tags = {MLFLOW_PARENT_RUN_ID: parent_run_id} if parent_run_id else {}
+    run = client.create_run(_experiment_id(client), tags=resolve_tags(tags))
+    logger = BatchLogger(run.info.run_id, client)
+    status = RunStatus.to_string(RunStatus.FAILED)
+    try:
+        try:
+            yield run, logger
+        finally:
+            logger.flush()
+        status = RunStatus.to_string(RunStatus.FINISHED)
+    finally:
+        client.set_terminated(run.info.run_id, status)
@@ -0,0 +1,174 @@
+"""In-band array transport: request/response bodies as .npz or Arrow IPC streams"""
+
+import io
+import json
+import zipfile
+
+import numpy as np
+from flask import Response
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional, .npz bodies work without it
+    pa = None
+
+# Uncompressed .npz archive, one .npy member per array
+NPZ_MIMETYPE = 'application/x-npz'
+
+# Arrow IPC stream: one column per row-aligned array, the rest in metadata
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+BINARY_MIMETYPES = (NPZ_MIMETYPE, ARROW_MIMETYPE)
+
+# Response header carrying the JSON fields that accompany binary arrays
+RESULT_HEADER = 'X-Result'
+
+# Rows per Arrow record batch when streaming a response
+ARROW_BATCH_ROWS = 4096
+
+
+class UnsupportedFormat(ValueError):
+    """An array format this process can't read or write (Arrow without pyarrow)"""
+
+
+def _require_arrow():
+    if pa is None:
+        raise UnsupportedFormat(f'{ARROW_MIMETYPE} needs pyarrow installed, use {NPZ_MIMETYPE} instead')
+
+
+def is_binary(request):
+    """Whether the request body holds arrays rather than JSON"""
+    return request.mimetype in BINARY_MIMETYPES
+
+
+def response_mimetype(request):
+    """
+    Binary format the caller asked for in Accept, None for JSON
+
+    Defaults to the request's own binary format so a chained call gets
+    back what it sent.
+
+    Raises:
+        UnsupportedFormat: If that is Arrow and pyarrow isn't installed
+    """
+    best = request.accept_mimetypes.best_match(BINARY_MIMETYPES + ('application/json',))
+    if best in BINARY_MIMETYPES and request.accept_mimetypes[best] > request.accept_mimetypes['application/json']:
+        mimetype = best
+    else:
+        mimetype = request.mimetype if is_binary(request) else None
+    if mimetype == ARROW_MIMETYPE:
+        _require_arrow()
+    return mimetype
+
+
+def request_config(request):
+    """JSON config sent next to a binary body, in the ``config`` query parameter"""
+    return json.loads(request.args.get('config') or '{}')
+
+
+def decode_arrays(body, mimetype):
+    """
+    Decode a binary body into arrays
+
+    Args:
+        body (bytes): Request body
+        mimetype (str): NPZ_MIMETYPE or ARROW_MIMETYPE
+
+    Returns:
+        dict: Array name -> ndarray
+
+    Raises:
+        ValueError: If the body isn't a valid archive/stream of arrays
+            (UnsupportedFormat for Arrow without pyarrow)
+    """
+    if mimetype == NPZ_MIMETYPE:
+        try:
+            with np.load(io.BytesIO(body), allow_pickle=False) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            raise ValueError(f"Invalid .npz body: {e}") from e
+
+    _require_arrow()
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+        layout = json.loads(table.schema.metadata[b'arrays'])
+    except (pa.ArrowException, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid Arrow body: {e}") from e
+    arrays = {}
+    for name, spec in layout.items():
+        dtype = np.dtype(spec['dtype'])
+        if 'values' in spec:
+            arrays[name] = np.asarray(spec['values'], dtype=dtype).reshape(spec['shape'])
+            continue
+        column = table.column(name).combine_chunks()
+        if pa.types.is_fixed_size_list(column.type):
+            column = column.flatten()
+        arrays[name] = column.to_numpy(zero_copy_only=False).astype(dtype, copy=False).reshape(spec['shape'])
+    return arrays
+
+
+def encode_npz(arrays):
+    """Uncompressed .npz bytes of arrays"""
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def iter_arrow(arrays, batch_rows=ARROW_BATCH_ROWS):
+    """
+    Yield an Arrow IPC stream of arrays in record batches
+
+    Arrays sharing the first array's length become columns (samples
+    flattened into fixed-size lists); others are small side arrays and
+    travel in the schema metadata.
+    """
+    _require_arrow()
+    n_rows = len(next(iter(arrays.values())))
+    layout = {}
+    columns = {}
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        layout[name] = {'shape': list(array.shape), 'dtype': array.dtype.str}
+        if array.ndim and len(array) == n_rows:
+            # An explicit row width, -1 can't be inferred from zero rows
+            columns[name] = array.reshape(n_rows, int(np.prod(array.shape[1:]))) if array.ndim > 1 else array
+        else:
+            layout[name]['values'] = array.tolist()
+
+    def column_type(array):
+        value_type = pa.from_numpy_dtype(array.dtype)
+        return pa.list_(value_type, array.shape[1]) if array.ndim > 1 else value_type
+
+    schema = pa.schema(
+        [(name, column_type(array)) for name, array in columns.items()],
+        metadata={'arrays': json.dumps(layout)}
+    )
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for start in range(0, max(n_rows, 1), batch_rows):
+            batch = []
+            for name, array in columns.items():
+                rows = np.ascontiguousarray(array[start:start + batch_rows])
+                if rows.ndim > 1:
+                    batch.append(pa.FixedSizeListArray.from_arrays(pa.array(rows.reshape(-1)), rows.shape[1]))
+                else:
+                    batch.append(pa.array(rows))
+            writer.write_batch(pa.record_batch(batch, schema=schema))
+            # Hand each batch to the server as soon as it's written
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+def array_response(arrays, mimetype, result=None):
+    """
+    Flask response carrying arrays in mimetype
+
+    JSON fields that go with the arrays (status, metrics, ...) travel in
+    the X-Result header.
+    """
+    headers = {RESULT_HEADER: json.dumps(result or {}, default=str)}
+    if mimetype == ARROW_MIMETYPE:
+        return Response(iter_arrow(arrays), mimetype=ARROW_MIMETYPE, headers=headers)
+    return Response(encode_npz(arrays), mimetype=NPZ_MIMETYPE, headers=headers)
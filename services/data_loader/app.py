@@ -1,49 +1,475 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 import os
+import time
+import io
+import json
+import shutil
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 from sklearn.model_selection import train_test_split
+from common.transport import array_response, response_mimetype
 
 app = Flask(__name__)
 
 # Configuration
-DATA_DIR = "/data"
+DATA_DIR = os.getenv("LOADER_DATA_DIR", "/data")
 CLASSES = ["normal", "dyed-lifted-polyps"]
 IMAGE_SIZE = (224, 224)
+SPLITS = ["train", "test"]
 
-def process_images():
-    """Load and process all images, returning summary stats"""
-    image_counts = {cls: 0 for cls in CLASSES}
-    shapes = []
-    
+# Packed decoded datasets, one directory per source digest
+CACHE_DIR = os.getenv("LOADER_CACHE_DIR", "/app/data/cache")
+MANIFEST_PATH = os.path.join(CACHE_DIR, "manifest.json")
+_INGEST_LOCK = threading.Lock()
+
+# Published stores kept on disk, the current one included; older ones are
+# deleted so paths handed out by recent /load calls stay readable
+KEEP_STORES = max(int(os.getenv("LOADER_KEEP_STORES", 2)), 1)
+
+# Decode pool, OpenCV releases the GIL so threads scale across cores
+NUM_WORKERS = int(os.getenv("LOADER_WORKERS", os.cpu_count() or 1))
+DECODE_CHUNK_SIZE = int(os.getenv("LOADER_CHUNK_SIZE", 32))
+
+@contextmanager
+def ingest_lock():
+    """Serialize ingests across threads and across gunicorn worker processes"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with _INGEST_LOCK, open(os.path.join(CACHE_DIR, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def list_images():
+    """Collect path, class, split, size and mtime for every file under DATA_DIR"""
+    entries = []
     for class_name in CLASSES:
-        for split in ["train", "test"]:
+        for split in SPLITS:
             dir_path = os.path.join(DATA_DIR, split, class_name)
             if not os.path.exists(dir_path):
                 continue
-                
-            for filename in os.listdir(dir_path):
+
+            for filename in sorted(os.listdir(dir_path)):
                 img_path = os.path.join(dir_path, filename)
-                img = cv2.imread(img_path)
-                if img is not None:
-                    img = cv2.resize(img, IMAGE_SIZE)
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                    image_counts[class_name] += 1
-                    shapes.append(img.shape)
-    
+                stat = os.stat(img_path)
+                entries.append({
+                    "path": img_path,
+                    "rel_path": os.path.relpath(img_path, DATA_DIR),
+                    "class": class_name,
+                    "split": split,
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns
+                })
+    return entries
+
+def decode_chunk(items):
+    """
+    Read, hash, decode and resize a chunk of images, timing each stage
+
+    Takes (path, known_hash) pairs. A file whose bytes still hash to
+    known_hash is not decoded and comes back as (hash, None, True).
+    """
+    results = []
+    decode_time = 0.0
+    resize_time = 0.0
+
+    for img_path, known_hash in items:
+        start = time.perf_counter()
+        with open(img_path, "rb") as f:
+            data = f.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 == known_hash:
+            decode_time += time.perf_counter() - start
+            results.append((sha256, None, True))
+            continue
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+        decode_time += time.perf_counter() - start
+
+        if img is not None:
+            start = time.perf_counter()
+            img = cv2.resize(img, IMAGE_SIZE)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            resize_time += time.perf_counter() - start
+        results.append((sha256, img, False))
+
+    return results, decode_time, resize_time
+
+def source_digest(entries):
+    """Fingerprint the source tree from file names, sizes and mtimes"""
+    digest = hashlib.sha256(repr((CLASSES, IMAGE_SIZE)).encode())
+    for entry in entries:
+        digest.update(f"{entry['rel_path']}\0{entry['size']}\0{entry['mtime_ns']}\n".encode())
+    return digest.hexdigest()[:16]
+
+def load_manifest():
+    """Read the manifest describing the current store, empty if there is none"""
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"store": None, "files": {}, "previous": []}
+
+def summarize(meta, changes, throughput=None):
+    """Build data_stats from a store's metadata"""
     return {
-        "total_images": sum(image_counts.values()),
-        "class_counts": image_counts,
-        "unique_shapes": list(set(shapes))  # Get unique shapes found
+        "total_images": meta["total_images"],
+        "class_counts": meta["class_counts"],
+        "unique_shapes": [list(meta["image_shape"])],
+        "cached": throughput is None,
+        **changes,
+        "throughput": throughput or {}
     }
 
+def publish_store(manifest, store_path, files):
+    """
+    Point the manifest at store_path and delete stores past KEEP_STORES
+
+    The store that was current is kept as the most recent previous one.
+    Deleting a store unlinks its files without modifying them, so memory
+    maps other services still hold keep working.
+    """
+    previous = [manifest["store"]] + manifest.get("previous", []) if manifest["store"] else []
+    previous = [path for path in dict.fromkeys(previous) if path != store_path]
+    kept, retired = previous[:KEEP_STORES - 1], previous[KEEP_STORES - 1:]
+    with open(MANIFEST_PATH + ".tmp", "w") as f:
+        json.dump({"store": store_path, "files": files, "previous": kept}, f)
+    os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
+    for path in retired:
+        shutil.rmtree(path, ignore_errors=True)
+
+def manifest_files(entries, rows):
+    """Manifest entries of entries stored at rows (-1 for unreadable files)"""
+    return {
+        entry["rel_path"]: {
+            "size": entry["size"],
+            "mtime_ns": entry["mtime_ns"],
+            "sha256": entry["sha256"],
+            "row": int(row)
+        }
+        for entry, row in zip(entries, rows)
+    }
+
+def move_into_place(tmp_path, store_path):
+    """Publish a finished store directory under its digest name"""
+    try:
+        os.replace(tmp_path, store_path)
+    except OSError:
+        # Another process finished the same store first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+def store_meta(labels, splits):
+    """meta.json contents for a store with these per-row labels and splits"""
+    return {
+        "classes": CLASSES,
+        "splits": SPLITS,
+        "image_shape": (IMAGE_SIZE[1], IMAGE_SIZE[0], 3),
+        "total_images": len(labels),
+        "class_counts": {cls: int((labels == i).sum()) for i, cls in enumerate(CLASSES)},
+        "split_counts": {split: int((splits == i).sum()) for i, split in enumerate(SPLITS)}
+    }
+
+def images_header(rows):
+    """.npy header of an images.npy holding rows images"""
+    buffer = io.BytesIO()
+    np.lib.format.write_array_header_1_0(buffer, {
+        "descr": np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+        "fortran_order": False,
+        "shape": (rows, IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+    })
+    return buffer.getvalue()
+
+def process_images(workers=NUM_WORKERS, chunk_size=DECODE_CHUNK_SIZE):
+    """
+    Ingest every image into a packed uint8 store and return summary stats
+
+    The store is a directory under CACHE_DIR named after the source digest
+    holding images.npy (N, H, W, 3), labels.npy (class index) and
+    split.npy (0 = train, 1 = test), all loadable with mmap_mode='r'.
+
+    Published stores are never modified: other services memory-map them
+    by path. A manifest of (path, size, mtime, hash, row) next to the
+    stores makes re-ingest incremental: a patched copy of the current
+    store is written under the new digest (see patch_store) so only new
+    and changed images are decoded, then the manifest is pointed at it.
+    The first ingest, or one the current store can't be patched for,
+    builds the store from scratch (see build_store).
+    """
+    with ingest_lock():
+        entries = list_images()
+        store_path = os.path.join(CACHE_DIR, source_digest(entries))
+        meta_path = os.path.join(store_path, "meta.json")
+        no_changes = {"added": 0, "changed": 0, "removed": 0}
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                return store_path, summarize(json.load(f), no_changes)
+
+        manifest = load_manifest()
+        if manifest["store"] and os.path.exists(os.path.join(manifest["store"], "meta.json")):
+            result = patch_store(manifest, entries, store_path, workers, chunk_size)
+            if result is not None:
+                return result
+        return build_store(manifest, entries, store_path, workers, chunk_size)
+
+def decode_rows(entries, to_read, images, rows, workers, chunk_size):
+    """
+    Decode to_read ((entry index, known hash) pairs) into images[rows[i]]
+
+    Sets each entry's sha256. Files whose hash is unchanged are left
+    alone, files that no longer decode get row -1.
+
+    Returns:
+        tuple: (changed files, decode seconds, resize seconds) summed over workers
+    """
+    def decode_into(chunk):
+        results, decode_time, resize_time = decode_chunk(
+            [(entries[i]["path"], known_hash) for i, known_hash in chunk]
+        )
+        changed = 0
+        for (i, known_hash), (sha256, img, same) in zip(chunk, results):
+            entries[i]["sha256"] = sha256
+            if same:
+                continue
+            if known_hash is not None:
+                changed += 1
+            if img is None:
+                rows[i] = -1
+            else:
+                images[rows[i]] = img
+        return changed, decode_time, resize_time
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        stage_times = list(pool.map(
+            decode_into, [to_read[i:i + chunk_size] for i in range(0, len(to_read), chunk_size)]
+        ))
+    return (sum(c for c, _, _ in stage_times),
+            sum(t for _, t, _ in stage_times),
+            sum(t for _, _, t in stage_times))
+
+def ingest_stats(meta, added, changed, removed, decoded, elapsed, decode_time, resize_time, workers, chunk_size, mode):
+    """data_stats of an ingest, mode is 'patch' or 'build'"""
+    # Stage times are summed over workers, divide back to per-stage wall time
+    total = meta["total_images"]
+    return summarize(meta, {"added": added, "changed": changed, "removed": removed}, {
+        "mode": mode,
+        "workers": workers,
+        "chunk_size": chunk_size,
+        "elapsed_seconds": elapsed,
+        "images_per_s": total / elapsed if elapsed else 0.0,
+        "decoded_images": decoded,
+        "decode_images_per_s": decoded * workers / decode_time if decode_time else 0.0,
+        "resize_images_per_s": decoded * workers / resize_time if resize_time else 0.0
+    })
+
+def patch_store(manifest, entries, store_path, workers, chunk_size):
+    """
+    Write an updated copy of the current store to store_path
+
+    images.npy is copied first (shutil.copyfile, which shares extents on
+    filesystems with reflinks), then the copy is patched: changed files
+    overwrite their own row, new files take rows freed by deleted ones
+    and then append, and rows still free at the end are filled with the
+    last rows. Only those rows are written. The current store itself is
+    left untouched.
+
+    Returns:
+        tuple: As process_images, None if the store can't be patched
+        (nothing is written then)
+    """
+    old_store = manifest["store"]
+    previous = manifest["files"]
+    image_shape = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+    row_bytes = int(np.prod(image_shape))
+
+    with open(os.path.join(old_store, "images.npy"), "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version != (1, 0):
+            return None
+        shape, _, _ = np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+    if tuple(shape[1:]) != image_shape:
+        return None
+
+    # Row of every entry: its old row, or one to fill for new files
+    rows = np.full(len(entries), -1, dtype=np.int64)
+    to_read = []
+    needs_row = []
+    added = 0
+    for i, entry in enumerate(entries):
+        old = previous.get(entry["rel_path"])
+        if old is None:
+            added += 1
+            to_read.append((i, None))
+            needs_row.append(i)
+        elif old["size"] == entry["size"] and old["mtime_ns"] == entry["mtime_ns"]:
+            entry["sha256"] = old["sha256"]
+            rows[i] = old["row"]
+        else:
+            to_read.append((i, old["sha256"]))
+            rows[i] = old["row"]
+            if old["row"] < 0:
+                # Couldn't be decoded before, may be readable now
+                needs_row.append(i)
+    current = {entry["rel_path"] for entry in entries}
+    gone = [old for rel_path, old in previous.items() if rel_path not in current]
+    freed = sorted(old["row"] for old in gone if old["row"] >= 0)
+
+    capacity = shape[0] + max(len(needs_row) - len(freed), 0)
+    if len(images_header(0)) != offset or len(images_header(capacity)) != offset:
+        return None
+    rows[needs_row] = (freed + list(range(shape[0], capacity)))[:len(needs_row)]
+
+    tmp_path = f"{store_path}.tmp{os.getpid()}"
+    images_path = os.path.join(tmp_path, "images.npy")
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        start = time.perf_counter()
+        shutil.copyfile(os.path.join(old_store, "images.npy"), images_path)
+        with open(images_path, "r+b") as f:
+            f.truncate(offset + capacity * row_bytes)
+        images = np.memmap(images_path, dtype=np.uint8, mode="r+", offset=offset, shape=(capacity,) + image_shape)
+
+        changed, decode_time, resize_time = decode_rows(entries, to_read, images, rows, workers, chunk_size)
+        for i, known_hash in to_read:
+            if known_hash == entries[i]["sha256"] and previous[entries[i]["rel_path"]]["row"] < 0:
+                # Touched but still the same unreadable file
+                rows[i] = -1
+
+        # Fill rows left free with the last rows so the store stays dense
+        n_rows = int((rows >= 0).sum())
+        owner = {int(row): i for i, row in enumerate(rows) if row >= 0}
+        holes = [row for row in range(n_rows) if row not in owner]
+        tail = sorted((row for row in owner if row >= n_rows), reverse=True)
+        for hole, row in zip(holes, tail):
+            images[hole] = images[row]
+            rows[owner[row]] = hole
+        images.flush()
+        del images
+        with open(images_path, "r+b") as f:
+            f.write(images_header(n_rows))
+            f.truncate(offset + n_rows * row_bytes)
+
+        labels = np.empty(n_rows, dtype=np.int64)
+        splits = np.empty(n_rows, dtype=np.uint8)
+        for entry, row in zip(entries, rows):
+            if row >= 0:
+                labels[row] = CLASSES.index(entry["class"])
+                splits[row] = SPLITS.index(entry["split"])
+        np.save(os.path.join(tmp_path, "labels.npy"), labels)
+        np.save(os.path.join(tmp_path, "split.npy"), splits)
+        elapsed = time.perf_counter() - start
+
+        meta = store_meta(labels, splits)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    move_into_place(tmp_path, store_path)
+    publish_store(manifest, store_path, manifest_files(entries, rows))
+    return store_path, ingest_stats(meta, added, changed, len(gone), len(to_read), elapsed,
+                                    decode_time, resize_time, workers, chunk_size, "patch")
+
+def build_store(manifest, entries, store_path, workers, chunk_size):
+    """
+    Decode every image into a new store at store_path
+
+    Used for the first ingest and whenever the current store can't be
+    patched. The store is built in a scratch directory and moved into
+    place once complete.
+    """
+    previous = manifest["files"]
+    tmp_path = f"{store_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    image_shape = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+    images = np.lib.format.open_memmap(
+        os.path.join(tmp_path, "images.npy"), mode="w+", dtype=np.uint8,
+        shape=(len(entries),) + image_shape
+    )
+    rows = np.arange(len(entries))
+
+    start = time.perf_counter()
+    _, decode_time, resize_time = decode_rows(
+        entries, [(i, None) for i in range(len(entries))], images, rows, workers, chunk_size
+    )
+    valid = rows >= 0
+
+    kept = [entry for entry, ok in zip(entries, valid) if ok]
+    if len(kept) < len(entries):
+        # Drop unreadable files by compacting into a right-sized store
+        packed = np.lib.format.open_memmap(
+            os.path.join(tmp_path, "images.packed.npy"), mode="w+", dtype=np.uint8,
+            shape=(len(kept),) + image_shape
+        )
+        for dst, src in enumerate(np.flatnonzero(valid)):
+            packed[dst] = images[src]
+        packed.flush()
+        del packed
+        os.replace(os.path.join(tmp_path, "images.packed.npy"), os.path.join(tmp_path, "images.npy"))
+    else:
+        images.flush()
+    del images
+
+    labels = np.array([CLASSES.index(entry["class"]) for entry in kept], dtype=np.int64)
+    splits = np.array([SPLITS.index(entry["split"]) for entry in kept], dtype=np.uint8)
+    np.save(os.path.join(tmp_path, "labels.npy"), labels)
+    np.save(os.path.join(tmp_path, "split.npy"), splits)
+    elapsed = time.perf_counter() - start
+
+    meta = store_meta(labels, splits)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    move_into_place(tmp_path, store_path)
+
+    # Rows in the final store, -1 marks files that couldn't be decoded
+    final_rows = np.where(valid, np.cumsum(valid) - 1, -1)
+    publish_store(manifest, store_path, manifest_files(entries, final_rows))
+
+    current = {entry["rel_path"] for entry in entries}
+    added = sum(1 for entry in entries if entry["rel_path"] not in previous)
+    changed = sum(1 for entry in entries
+                  if entry["rel_path"] in previous and previous[entry["rel_path"]]["sha256"] != entry["sha256"])
+    removed = sum(1 for rel_path in previous if rel_path not in current)
+    return store_path, ingest_stats(meta, added, changed, removed, len(entries), elapsed,
+                                    decode_time, resize_time, workers, chunk_size, "build")
+
+def store_response(store_path, split, mimetype, result):
+    """Send the store itself (optionally one split) instead of its path"""
+    arrays = {name: np.load(os.path.join(store_path, f"{name}.npy"), mmap_mode="r")
+              for name in ("images", "labels", "split")}
+    if split is not None:
+        rows = arrays["split"] == SPLITS.index(split)
+        arrays = {name: array[rows] for name, array in arrays.items()}
+    return array_response(arrays, mimetype, result)
+
 @app.route('/load', methods=['POST'])
 def load_data():
     try:
-        stats = process_images()
+        mimetype = response_mimetype(request)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        body = request.get_json(silent=True) or {}
+        store_path, stats = process_images(
+            workers=int(body.get("workers", NUM_WORKERS)),
+            chunk_size=int(body.get("chunk_size", DECODE_CHUNK_SIZE))
+        )
+
+        if mimetype is not None:
+            return store_response(store_path, body.get("split"), mimetype,
+                                  {"status": "success", "path": store_path, "data_stats": stats})
         
         return jsonify({
             "status": "success",
+            "path": store_path,
             "data_stats": stats,
             "message": "All images processed successfully"
         })
@@ -54,6 +480,10 @@ def load_data():
             "message": str(e)
         }), 500
 
+@app.route('/health')
+def health():
+    return {'status': 'healthy'}, 200
+
 @app.route('/')
 def home():
     return jsonify({"status": "ready"})
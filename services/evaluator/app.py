@@ -1,5 +1,9 @@
 from flask import Flask, request, jsonify
-import mlflow
+from common.labels import CSV_LABEL_SCALE, encode_csv_targets, encode_labels
+from common.npz import open_arrays
+from common.tracking import batched_run
+from common.transport import decode_arrays, is_binary, request_config
+import numpy as np
 import pandas as pd
 from sklearn.metrics import (
     accuracy_score,
@@ -8,78 +12,287 @@ from sklearn.metrics import (
     f1_score,
     confusion_matrix
 )
-import json
-import seaborn as sns
-import matplotlib.pyplot as plt
 import os
 import json  
+from model_cache import model_cache
+from artifact_queue import artifact_queue
+from batcher import batcher_stats, get_batcher
 
 app = Flask(__name__)
 
-@app.route('/evaluate', methods=['POST'])
-def evaluate():
-    try:
-        eval_config = request.json
-        data_path = eval_config['data_path']
-        model_uri = eval_config['model_uri']
-        
-        # Load data and model
-        df = pd.read_csv(data_path)
-        X = df.drop('target', axis=1)
-        y_true = df['target']
-        model = mlflow.sklearn.load_model(model_uri)
-        
-        # Make predictions
+# Rows predicted per step in streaming evaluation
+STREAM_CHUNK_SIZE = 10000
+
+# Confusion matrix files, one directory per run, before upload
+METRICS_DIR = os.getenv("EVALUATOR_METRICS_DIR", "/app/metrics")
+
+def iter_batches(data_path, chunk_size, label_scale=CSV_LABEL_SCALE):
+    """
+    Yield (X, y_true) batches from a CSV, an .npz archive or a .npy store
+
+    CSVs are read with pandas in chunks. Stores and uncompressed .npz
+    archives are memory-mapped (see common.npz.open_arrays), so only one
+    batch is in memory at a time. Images are flattened to one row per
+    sample and labels encoded like the trainer does; CSV targets are
+    scaled the way common.convert stores them first.
+    """
+    if data_path.endswith('.csv'):
+        for df in pd.read_csv(data_path, chunksize=chunk_size):
+            yield df.drop('target', axis=1), encode_csv_targets(df['target'], label_scale)
+        return
+
+    arrays = open_arrays(data_path)
+    yield from iter_array_batches(arrays['images'], arrays['labels'], chunk_size)
+
+def iter_array_batches(images, labels, chunk_size):
+    """Yield (X, y_true) batches of in-memory (or memory-mapped) arrays"""
+    for start in range(0, len(images), chunk_size):
+        batch = images[start:start + chunk_size]
+        yield batch.reshape(len(batch), -1), encode_labels(labels[start:start + chunk_size])
+
+def stream_confusion_matrix(model, batches, source):
+    """
+    Predict batch by batch, accumulating (true, predicted) pair counts
+
+    Args:
+        batches: Iterable of (X, y_true), see iter_batches
+        source (str): Named in the error when there are no batches
+
+    Returns:
+        tuple: (confusion matrix over the sorted label union, samples, features)
+    """
+    counts = None
+    n_samples = 0
+    n_features = 0
+    for X, y_true in batches:
         y_pred = model.predict(X)
-        
-        # Calculate metrics
-        metrics = {
-            'accuracy': accuracy_score(y_true, y_pred),
-            'precision': precision_score(y_true, y_pred, average='weighted'),
-            'recall': recall_score(y_true, y_pred, average='weighted'),
-            'f1': f1_score(y_true, y_pred, average='weighted')
-        }
-        
-        # Generate confusion matrix visualization
-        os.makedirs('/app/metrics', exist_ok=True)
-        cm = confusion_matrix(y_true, y_pred)
-        
+        pairs = pd.DataFrame({'true': y_true, 'pred': y_pred}).value_counts()
+        counts = pairs if counts is None else counts.add(pairs, fill_value=0)
+        n_samples += len(X)
+        n_features = X.shape[1]
+
+    if counts is None:
+        raise ValueError(f"No samples found in {source}")
+
+    labels = sorted(set(counts.index.get_level_values('true')) | set(counts.index.get_level_values('pred')))
+    cm = counts.unstack(fill_value=0).reindex(index=labels, columns=labels, fill_value=0)
+    return cm.to_numpy().astype(int), n_samples, n_features
+
+def metrics_from_confusion(cm):
+    """Accuracy and support-weighted precision/recall/F1 from a confusion matrix"""
+    tp = np.diag(cm).astype(float)
+    support = cm.sum(axis=1)
+    predicted = cm.sum(axis=0)
+
+    # Classes never predicted or never present score 0, as in sklearn
+    precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+    recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+    denom = precision + recall
+    f1 = np.divide(2 * precision * recall, denom, out=np.zeros_like(tp), where=denom > 0)
+
+    weights = support / support.sum()
+    return {
+        'accuracy': float(tp.sum() / cm.sum()),
+        'precision': float(precision @ weights),
+        'recall': float(recall @ weights),
+        'f1': float(f1 @ weights)
+    }
+
+def log_evaluation(params, metrics, cm):
+    """
+    Render the confusion matrix and log everything to MLflow
+
+    Runs on the artifact queue worker; matplotlib and seaborn are imported
+    here so they stay off the service's start-up path.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    with batched_run() as (run, tracker):
+        metrics_dir = os.path.join(METRICS_DIR, run.info.run_id)
+        os.makedirs(metrics_dir, exist_ok=True)
+
         # Save as JSON
-        cm_json_path = "/app/metrics/confusion_matrix.json"
+        cm_json_path = os.path.join(metrics_dir, "confusion_matrix.json")
         with open(cm_json_path, 'w') as f:
             json.dump(cm.tolist(), f)
-        
+
         # Save as PNG
-        plt.figure(figsize=(10, 8))
+        fig = plt.figure(figsize=(10, 8))
         sns.heatmap(cm, annot=True, fmt='d')
         plt.title('Confusion Matrix')
-        cm_png_path = "/app/metrics/confusion_matrix.png"
-        plt.savefig(cm_png_path, bbox_inches='tight')
-        plt.close()
-        
-        # Log to MLflow
-        with mlflow.start_run():
-            mlflow.log_params({
-                'eval_data_path': data_path,
-                'model_uri': model_uri,
-                'dataset_samples': len(df),
-                'num_features': X.shape[1]
-            })
-            
-            mlflow.log_metrics(metrics)
-            mlflow.log_artifact(cm_json_path)
-            mlflow.log_artifact(cm_png_path)
-            mlflow.log_dict(metrics, "metrics.json")
-        
+        cm_png_path = os.path.join(metrics_dir, "confusion_matrix.png")
+        fig.savefig(cm_png_path, bbox_inches='tight')
+        plt.close(fig)
+
+        tracker.log_params(params)
+        tracker.log_metrics(metrics)
+        tracker.log_artifact(cm_json_path)
+        tracker.log_artifact(cm_png_path)
+        tracker.log_dict(metrics, "metrics.json")
+
+        return {
+            'run_id': run.info.run_id,
+            'confusion_matrix': cm_png_path,
+            'artifacts_uri': run.info.artifact_uri
+        }
+
+@app.route('/evaluate', methods=['POST'])
+def evaluate():
+    try:
+        if is_binary(request):
+            # Test arrays in the body, config (model_uri, ...) in the query
+            eval_config = request_config(request)
+            arrays = decode_arrays(request.get_data(), request.mimetype)
+            data_path = 'in-band'
+        else:
+            eval_config = request.json
+            data_path = eval_config['data_path']
+        model_uri = eval_config['model_uri']
+    except (KeyError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Invalid evaluate request: {e}"}), 400
+
+    try:
+        model = model_cache.get(model_uri)
+        label_scale = eval_config.get('label_scale', CSV_LABEL_SCALE)
+
+        if data_path == 'in-band' or eval_config.get('stream', False):
+            # Chunked pass, only confusion-matrix counts are kept
+            chunk_size = int(eval_config.get('chunk_size', STREAM_CHUNK_SIZE))
+            if data_path == 'in-band':
+                batches = iter_array_batches(arrays['images'], arrays['labels'], chunk_size)
+            else:
+                batches = iter_batches(data_path, chunk_size, label_scale)
+            cm, n_samples, n_features = stream_confusion_matrix(model, batches, data_path)
+            metrics = metrics_from_confusion(cm)
+        else:
+            # Load data
+            df = pd.read_csv(data_path)
+            X = df.drop('target', axis=1)
+            y_true = encode_csv_targets(df['target'], label_scale)
+            n_samples, n_features = X.shape
+
+            # Make predictions
+            y_pred = model.predict(X)
+
+            # Calculate metrics
+            metrics = {
+                'accuracy': accuracy_score(y_true, y_pred),
+                'precision': precision_score(y_true, y_pred, average='weighted'),
+                'recall': recall_score(y_true, y_pred, average='weighted'),
+                'f1': f1_score(y_true, y_pred, average='weighted')
+            }
+            cm = confusion_matrix(y_true, y_pred)
+
+        # Plots and MLflow uploads happen in the background
+        job_id, artifact_status = artifact_queue.submit(log_evaluation, {
+            'eval_data_path': data_path,
+            'model_uri': model_uri,
+            'dataset_samples': n_samples,
+            'num_features': n_features
+        }, metrics, cm)
+
         return jsonify({
             'status': 'success',
             'metrics': metrics,
-            'confusion_matrix': cm_png_path,
-            'artifacts_uri': mlflow.active_run().info.artifact_uri
+            'artifact_job_id': job_id,
+            'artifact_status': artifact_status
         })
     
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/evaluate/status/<job_id>', methods=['GET'])
+def evaluate_status(job_id):
+    job = artifact_queue.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job: {job_id}"}), 404
+    return jsonify(job)
+
+def predict_model_uri():
+    """Model URI of a /predict request, from the query string for octet-stream bodies"""
+    if request.mimetype == 'application/octet-stream':
+        return request.args['model_uri']
+    return request.get_json()['model_uri']
+
+def parse_predict_request(batcher):
+    """
+    Read the rows X of a /predict request for the model behind batcher
+
+    JSON bodies carry ``model_uri`` and ``instances`` (a list of rows).
+    ``application/octet-stream`` bodies are raw little-endian float32
+    rows, with ``model_uri`` (and optionally ``n_features``) in the query
+    string; the row width defaults to the model's ``n_features_in_``.
+    """
+    if request.mimetype == 'application/octet-stream':
+        X = np.frombuffer(request.get_data(), dtype='<f4')
+        n_features = request.args.get('n_features', type=int)
+        if n_features is None:
+            n_features = batcher.model.n_features_in_
+        if X.size % n_features:
+            raise ValueError(f"Payload of {X.size} floats is not a multiple of {n_features} features")
+        return X.reshape(-1, n_features)
+
+    X = np.asarray(request.get_json()['instances'], dtype=np.float32)
+    return X.reshape(len(X), -1)
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    try:
+        model_uri = predict_model_uri()
+    except (KeyError, TypeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid predict request: {e}"}), 400
+
+    try:
+        # Resolved once per request, the model's row width is needed to parse raw bodies
+        batcher = get_batcher(model_uri)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    try:
+        X = parse_predict_request(batcher)
+    except (KeyError, ValueError, TypeError, AttributeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid predict request: {e}"}), 400
+
+    try:
+        # One bad request must not fail the batch it would be stacked into
+        n_features = getattr(batcher.model, 'n_features_in_', None)
+        if n_features is not None and X.shape[1] != n_features:
+            return jsonify({
+                "status": "error",
+                "message": f"Invalid predict request: rows have {X.shape[1]} features, model expects {n_features}"
+            }), 400
+        result = batcher.predict(X)
+        return jsonify({
+            'status': 'success',
+            'predictions': result['predictions'].tolist(),
+            'probabilities': None if result['probabilities'] is None else result['probabilities'].tolist(),
+            'classes': batcher.model.classes_.tolist() if hasattr(batcher.model, 'classes_') else None,
+            'batch_size': result['batch_size']
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/predict/stats', methods=['GET'])
+def predict_stats():
+    return jsonify(batcher_stats())
+
+@app.route('/health')
+def health():
+    return {'status': 'healthy'}, 200
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(model_cache.stats())
+
+@app.route('/cache/invalidate', methods=['POST'])
+def cache_invalidate():
+    body = request.get_json(silent=True) or {}
+    # Batchers of the dropped models are closed by the cache's eviction callback
+    removed = model_cache.invalidate(body.get('model_uri'))
+    return jsonify({'status': 'success', 'invalidated': removed})
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5004)
\ No newline at end of file
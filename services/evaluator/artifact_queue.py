@@ -0,0 +1,64 @@
+import os
+import queue
+import threading
+
+from common.job_history import JobHistory
+
+
+class ArtifactQueue:
+    """
+    Bounded background queue for slow, non-critical work (plots, uploads)
+
+    Jobs run one at a time on a daemon thread. Each job gets an id whose
+    status moves pending -> running -> done/failed and can be polled; the
+    value the job function returns is stored as its result.
+    """
+
+    def __init__(self, max_size=32, max_history=1000):
+        self._queue = queue.Queue(maxsize=max_size)
+        self._history = JobHistory(max_history)
+        self._worker = None
+
+    def _ensure_worker(self):
+        # Started on first use so importing the app never spawns threads
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            job_id, fn, args = self._queue.get()
+            self._history.set(job_id, status='running')
+            try:
+                self._history.set(job_id, status='done', result=fn(*args))
+            except Exception as e:
+                self._history.set(job_id, status='failed', error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn, *args):
+        """
+        Enqueue fn(*args) without blocking
+
+        Returns:
+            tuple: (job id, status) where status is 'pending', or
+            'rejected' when the queue is full
+        """
+        job_id = self._history.add(status='pending')
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((job_id, fn, args))
+        except queue.Full:
+            self._history.set(job_id, status='rejected', error='Artifact queue is full')
+            return job_id, 'rejected'
+        return job_id, 'pending'
+
+    def status(self, job_id):
+        """Return a copy of the job record, None for unknown ids"""
+        return self._history.status(job_id)
+
+    def pending(self):
+        return self._queue.qsize()
+
+
+artifact_queue = ArtifactQueue(max_size=int(os.getenv('EVALUATOR_ARTIFACT_QUEUE_SIZE', 32)))
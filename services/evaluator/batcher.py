@@ -0,0 +1,216 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from model_cache import model_cache
+
+# Rows coalesced into one predict call at most; a request is never split
+MAX_BATCH_SIZE = int(os.getenv('EVALUATOR_MAX_BATCH_SIZE', 64))
+
+# How long the first request of a batch waits for others to join
+MAX_WAIT_MS = float(os.getenv('EVALUATOR_MAX_WAIT_MS', 5))
+
+# Latency samples kept per model for the percentiles
+LATENCY_WINDOW = 10000
+
+# Queued after the last request of a closed batcher, stops its worker
+_STOP = object()
+
+
+def _bucket(rows):
+    # Power-of-two histogram buckets: 1, 2, 4, 8, ...
+    return 1 << (rows - 1).bit_length()
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent predictions on one model into batched calls
+
+    Requests are queued; a worker thread takes the first one, waits up to
+    ``max_wait_ms`` for more to arrive (or until ``max_batch_size`` rows
+    are collected), then runs a single ``predict_proba`` over the stacked
+    rows and hands each caller its slice.
+
+    ``close`` stops the worker once the queued requests are served;
+    requests made after that are predicted on their own.
+    """
+
+    def __init__(self, model, model_uri=None, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.model_uri = model_uri
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._batch_sizes = Counter()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+
+    def _ensure_worker(self):
+        # Started on first use so importing the app never spawns threads;
+        # called with the lock held
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def predict(self, X, timeout=None):
+        """
+        Predict rows of X as part of the next batch
+
+        Returns:
+            dict: 'predictions', 'probabilities' (None if the model has no
+            predict_proba) and 'batch_size', the rows in the shared call
+        """
+        future = Future()
+        with self._lock:
+            # Nothing is queued after the stop marker
+            closed = self._closed
+            if not closed:
+                self._ensure_worker()
+                self._queue.put((X, future, time.perf_counter()))
+        if closed:
+            predictions, probabilities = self._predict_batch(X)
+            return {'predictions': predictions, 'probabilities': probabilities, 'batch_size': len(X)}
+        return future.result(timeout)
+
+    def close(self):
+        """Let the worker finish the queued requests, then stop it"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._worker is not None and self._worker.is_alive():
+                self._queue.put(_STOP)
+
+    def _collect(self):
+        # None once the stop marker is reached
+        item = self._queue.get()
+        if item is _STOP:
+            return None, 0
+        items = [item]
+        rows = len(item[0])
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Serve this batch first, stop on the next round
+                self._queue.put(_STOP)
+                break
+            items.append(item)
+            rows += len(item[0])
+        return items, rows
+
+    def _predict_batch(self, X):
+        if hasattr(self.model, 'predict_proba'):
+            probabilities = self.model.predict_proba(X)
+            return self.model.classes_[probabilities.argmax(axis=1)], probabilities
+        return self.model.predict(X), None
+
+    def _run(self):
+        while True:
+            items, rows = self._collect()
+            if items is None:
+                return
+            X = items[0][0] if len(items) == 1 else np.concatenate([x for x, _, _ in items])
+            try:
+                predictions, probabilities = self._predict_batch(X)
+            except Exception as e:
+                for _, future, _ in items:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            offset = 0
+            for x, future, enqueued in items:
+                stop = offset + len(x)
+                future.set_result({
+                    'predictions': predictions[offset:stop],
+                    'probabilities': None if probabilities is None else probabilities[offset:stop],
+                    'batch_size': rows
+                })
+                offset = stop
+
+            with self._lock:
+                self.requests += len(items)
+                self.rows += rows
+                self.batches += 1
+                self._batch_sizes[_bucket(rows)] += 1
+                self._latencies.extend(done - enqueued for _, _, enqueued in items)
+
+    def stats(self):
+        """Request/batch counters, latency percentiles and batch-size histogram"""
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            return {
+                'requests': self.requests,
+                'rows': self.rows,
+                'batches': self.batches,
+                'mean_batch_size': self.rows / self.batches if self.batches else 0.0,
+                'latency_ms': {
+                    'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                    'p99': float(np.percentile(latencies, 99)) if len(latencies) else None
+                },
+                'batch_size_histogram': [
+                    {'max_rows': bucket, 'batches': count} for bucket, count in sorted(self._batch_sizes.items())
+                ],
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000
+            }
+
+
+# Batchers by model cache key, one per model the cache holds
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def _drop_batcher(key):
+    with _batchers_lock:
+        batcher = _batchers.pop(key, None)
+    if batcher is not None:
+        batcher.close()
+
+
+# A model leaving the cache takes its batcher (and worker thread) along
+model_cache.on_evict(_drop_batcher)
+
+
+def get_batcher(model_uri):
+    """
+    Batcher for the model currently at model_uri
+
+    The model is looked up through the model cache on every call, so a
+    model re-logged under the same URI gets a new batcher (once its
+    cached key expires, see ModelCache), and the old one is closed when
+    its model leaves the cache.
+    """
+    key, model = model_cache.lookup(model_uri)
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = MicroBatcher(model, model_uri)
+    if key not in model_cache:
+        # Evicted before the batcher was registered, close it now; this
+        # request is still served (unbatched)
+        _drop_batcher(key)
+    return batcher
+
+
+def batcher_stats():
+    with _batchers_lock:
+        batchers = dict(_batchers)
+    return {key: dict(batcher.stats(), model_uri=batcher.model_uri) for key, batcher in batchers.items()}
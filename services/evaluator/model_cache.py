@@ -0,0 +1,163 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import mlflow
+from mlflow.models import Model
+
+
+def resolve_model_key(model_uri):
+    """
+    Resolve a model URI to (run_id, checksum of its MLmodel file)
+
+    Only the small MLmodel descriptor is downloaded, so re-logged models at
+    the same URI get a new key while unchanged ones hit the cache.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = mlflow.artifacts.download_artifacts(
+            artifact_uri=model_uri.rstrip('/') + '/MLmodel', dst_path=tmp
+        )
+        with open(path, 'rb') as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()[:16]
+        run_id = Model.load(path).run_id
+    return f"{run_id}:{checksum}"
+
+
+class ModelCache:
+    """
+    In-process LRU cache of loaded models, bounded by entry count
+
+    Callbacks registered with ``on_evict`` are called with the key of
+    every model leaving the cache (evicted or invalidated), so state
+    built around a model can go with it.
+
+    Resolving a URI to its key downloads the MLmodel file, so resolutions
+    are reused for key_ttl seconds while their model is cached: a model
+    re-logged under the same URI is picked up after at most key_ttl
+    seconds, or at once through ``invalidate``.
+    """
+
+    def __init__(self, max_size=4, key_ttl=30.0):
+        self.max_size = max_size
+        self.key_ttl = key_ttl
+        self._models = OrderedDict()
+        self._uris = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._evict_callbacks = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def on_evict(self, callback):
+        """Call callback(key) whenever a model leaves the cache"""
+        self._evict_callbacks.append(callback)
+
+    def _evicted(self, keys):
+        # Called outside the lock, callbacks may look the cache up again
+        for key in keys:
+            for callback in self._evict_callbacks:
+                callback(key)
+
+    def _resolve(self, model_uri):
+        """Cache key of model_uri, reusing a fresh resolution of a cached model"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._keys.get(model_uri)
+            if cached is not None and now - cached[1] < self.key_ttl and cached[0] in self._models:
+                return cached[0]
+        key = resolve_model_key(model_uri)
+        with self._lock:
+            self._keys[model_uri] = (key, now)
+        return key
+
+    def get(self, model_uri):
+        """Return the model at model_uri, loading it on a miss"""
+        return self.lookup(model_uri)[1]
+
+    def lookup(self, model_uri):
+        """
+        Resolve and load the model at model_uri
+
+        Returns:
+            tuple: (cache key, model), the key changes when the model is re-logged
+        """
+        key = self._resolve(model_uri)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return key, self._models[key]
+            self.misses += 1
+
+        # Load outside the lock so other models can be served meanwhile
+        model = mlflow.sklearn.load_model(model_uri)
+
+        evicted = []
+        with self._lock:
+            self._models[key] = model
+            self._models.move_to_end(key)
+            self._uris[key] = model_uri
+            while len(self._models) > self.max_size:
+                oldest, _ = self._models.popitem(last=False)
+                self._forget(oldest)
+                evicted.append(oldest)
+                self.evictions += 1
+        self._evicted(evicted)
+        return key, model
+
+    def _forget(self, key):
+        # Caller holds the lock
+        uri = self._uris.pop(key, None)
+        if uri is not None and self._keys.get(uri, (None,))[0] == key:
+            del self._keys[uri]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._models
+
+    def invalidate(self, model_uri=None):
+        """Drop one model URI (every cached version of it) or everything"""
+        with self._lock:
+            if model_uri is None:
+                keys = list(self._models)
+            else:
+                keys = [key for key, uri in self._uris.items() if uri == model_uri]
+            for key in keys:
+                self._models.pop(key, None)
+                self._forget(key)
+            if model_uri is None:
+                self._keys.clear()
+            else:
+                self._keys.pop(model_uri, None)
+        self._evicted(keys)
+        return len(keys)
+
+    def stats(self):
+        """Hit/miss counters and current contents"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._models),
+                'max_size': self.max_size,
+                'key_ttl': self.key_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'models': [
+                    {'key': key, 'model_uri': self._uris[key]} for key in self._models
+                ]
+            }
+
+
+# Seconds a URI's resolved key is trusted before MLmodel is checked again
+EVALUATOR_MODEL_KEY_TTL = float(os.getenv('EVALUATOR_MODEL_KEY_TTL', 30))
+
+model_cache = ModelCache(
+    max_size=int(os.getenv('EVALUATOR_MODEL_CACHE_SIZE', 4)),
+    key_ttl=EVALUATOR_MODEL_KEY_TTL
+)
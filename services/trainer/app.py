@@ -1,94 +1,533 @@
 from flask import Flask, request, jsonify
-import mlflow
 import numpy as np
 import shap
-from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
 import io
 import base64
 import pandas as pd
 import os
 import json  
+import queue
+import threading
+import time
+from mlflow.tracking import MlflowClient
+from jobs import job_queue
+from common.tracking import batched_run
+from common.transport import decode_arrays, is_binary, request_config
+from models import model_specs, fit_candidates, build_model, cross_validate
+from common.digest import content_digest
+from common.npz import open_arrays
+from feature_cache import feature_cache, prepare_in_memory, standardized
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import (
+    RandomForestClassifier,
+    ExtraTreesClassifier,
+    GradientBoostingClassifier
+)
 
 app = Flask(__name__)
 
+# SHAP settings
+SHAP_SAMPLES = 5  # Samples explained per plot
+SHAP_BACKGROUND_SIZE = 100  # Rows kept as background for the linear explainer
+SHAP_KMEANS_CLUSTERS = 10  # Background summary size for model-agnostic explainers
+SHAP_PLOT_DPI = int(os.getenv("SHAP_PLOT_DPI", 300))
+SHAP_DIR = os.getenv("SHAP_DIR", "/app/data/shap")  # Per-run plot files before upload
+TREE_MODELS = (
+    DecisionTreeClassifier,
+    RandomForestClassifier,
+    ExtraTreesClassifier,
+    GradientBoostingClassifier
+)
+# shap.TreeExplainer supports these for binary classification only
+BINARY_TREE_MODELS = (GradientBoostingClassifier,)
+
+# Held-out fraction used to rank candidate models
+VALIDATION_SPLIT = 0.2
+
+# Folds used when a request sets cv without a count
+CV_FOLDS = 5
+
+# Incremental (partial_fit) training defaults
+INCREMENTAL_MODEL = {'type': 'SGDClassifier', 'params': {'loss': 'log_loss'}}
+INCREMENTAL_BATCH_SIZE = 1024
+INCREMENTAL_EPOCHS = 5
+
+# pyplot keeps global state, background explanations must not interleave
+_PLOT_LOCK = threading.Lock()
+
 @app.route('/health')
 def health():
     return {'status': 'healthy'}, 200
 
-def create_shap_plot(model, X):
+def select_explainer(model, X):
+    """
+    Pick the cheapest SHAP explainer that fits the model
+
+    Linear models get the exact linear explainer and tree ensembles the
+    tree explainer; anything else (including multiclass gradient boosting,
+    which the tree explainer rejects) falls back to a model-agnostic
+    explainer over a k-means summary of X instead of the full training matrix.
+    """
+    if hasattr(model, 'coef_') and hasattr(model, 'intercept_'):
+        background = shap.maskers.Independent(X, max_samples=SHAP_BACKGROUND_SIZE)
+        return shap.LinearExplainer(model, background), 'linear'
+    multiclass = len(getattr(model, 'classes_', ())) > 2
+    if isinstance(model, TREE_MODELS) and not (multiclass and isinstance(model, BINARY_TREE_MODELS)):
+        return shap.TreeExplainer(model), 'tree'
+
+    k = min(SHAP_KMEANS_CLUSTERS, len(X))
+    background = shap.kmeans(X, k).data
+    return shap.Explainer(model.predict_proba, background), 'kmeans'
+
+def create_shap_plot(model, X, n_samples=SHAP_SAMPLES, plot_path=os.path.join(SHAP_DIR, "shap_plot.png")):
     """Generate SHAP explanation plot"""
-    explainer = shap.Explainer(model.predict_proba, X)
-    shap_values = explainer(X[:5])  # Explain first 5 samples
-    
-    plt.figure()
-    shap.plots.beeswarm(shap_values[:,:,1], show=False)
-    plt.tight_layout()
-    
-    # Save to buffer and file
+    explainer, kind = select_explainer(model, X)
+    shap_values = explainer(X[:n_samples])  # Explain the first n_samples
+
+    # Multi-output explanations keep one slice per class, plot class 1
+    if len(shap_values.shape) == 3:
+        shap_values = shap_values[:, :, 1]
+
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', dpi=300)
-    plt.close()
+    with _PLOT_LOCK:
+        plt.figure()
+        shap.plots.beeswarm(shap_values, show=False)
+        plt.tight_layout()
+
+        # Save to buffer and file
+        plt.savefig(buf, format='png', bbox_inches='tight', dpi=SHAP_PLOT_DPI)
+        plt.close()
     
     # Save to file for MLflow
-    os.makedirs('/app/data/shap', exist_ok=True)
-    plot_path = "/app/data/shap/shap_plot.png"
+    os.makedirs(os.path.dirname(plot_path), exist_ok=True)
     with open(plot_path, 'wb') as f:
         f.write(buf.getvalue())
     
     buf.seek(0)
-    return base64.b64encode(buf.read()).decode('utf-8'), plot_path
+    return base64.b64encode(buf.read()).decode('utf-8'), plot_path, kind
 
-@app.route('/quick_test', methods=['POST'])
-def quick_test():
-    try:
-        data = np.load(request.json['data_path'])
-        X = data['images'].reshape(len(data['images']), -1)
-        y = (data['labels'] * 4).astype(int)
-        
-        with mlflow.start_run():
-            # Log parameters
-            mlflow.log_params({
-                'model_type': 'LogisticRegression',
-                'max_iter': 1000,
-                'features': X.shape[1],
-                'samples': X.shape[0],
-                'classes': len(np.unique(y))
+def explain_in_background(run_id, model, X, n_samples):
+    """Compute the SHAP plot after the response and attach it to run_id"""
+    def work():
+        try:
+            _, plot_path, _ = create_shap_plot(
+                model, X, n_samples, plot_path=os.path.join(SHAP_DIR, run_id, "shap_plot.png")
+            )
+            MlflowClient().log_artifact(run_id, plot_path, "explanation")
+        except Exception:
+            app.logger.exception("SHAP explanation for run %s failed", run_id)
+
+    threading.Thread(target=work, daemon=True).start()
+
+def log_explanation_and_sample(tracker, model, X, config):
+    """
+    Log the SHAP plot and a sample of X through the run's BatchLogger
+
+    The model is already logged by then, so a failed explanation is logged
+    and skipped rather than failing the training job.
+
+    Returns:
+        tuple: (data URI of the plot or None, 'done', 'pending' or 'failed')
+    """
+    # Generate and log explanation
+    run_id = tracker.run_id
+    shap_samples = int(config.get('shap_samples', SHAP_SAMPLES))
+    if config.get('shap_async', False):
+        explain_in_background(run_id, model, X, shap_samples)
+        shap_plot, shap_status = None, "pending"
+    else:
+        try:
+            shap_plot_base64, shap_plot_path, _ = create_shap_plot(
+                model, X, shap_samples, plot_path=os.path.join(SHAP_DIR, run_id, "shap_plot.png")
+            )
+        except Exception:
+            app.logger.exception("SHAP explanation for run %s failed", run_id)
+            shap_plot, shap_status = None, "failed"
+        else:
+            tracker.log_artifact(shap_plot_path, "explanation")
+            shap_plot, shap_status = f"data:image/png;base64,{shap_plot_base64}", "done"
+
+    # Log sample data, staged per run so concurrent jobs don't collide
+    sample_path = tracker.staging_path("train_sample.csv")
+    pd.DataFrame(X[:100]).to_csv(sample_path)
+    tracker.log_artifact(sample_path)
+
+    return shap_plot, shap_status
+
+def training_config(req):
+    """
+    Training config of a request
+
+    A binary body (.npz or Arrow IPC) carries the dataset itself: the
+    config then comes from the ``config`` query parameter and the decoded
+    arrays replace data_path.
+    """
+    if is_binary(req):
+        config = request_config(req)
+        config['arrays'] = decode_arrays(req.get_data(), req.mimetype)
+        return config
+    return req.get_json(silent=True) or {}
+
+def training_matrix(config):
+    """
+    Prepared (X, y) for a training request, plus the prepared entry
+
+    Datasets at data_path go through the feature cache, keyed by content
+    digest, so repeated requests (any model type) memory-map the same
+    flattened float32 matrix instead of rebuilding it. In-band arrays are
+    prepared in memory. With ``standardize`` X is scaled with the
+    precomputed per-feature mean and std.
+
+    Returns:
+        tuple: (X, y, prepared dict, see feature_cache.prepare_in_memory)
+    """
+    if 'arrays' in config:
+        prepared = prepare_in_memory(config['arrays']['images'], config['arrays']['labels'])
+    else:
+        arrays = open_arrays(config['data_path'])
+        prepared = feature_cache.prepared(content_digest(config['data_path']), arrays)
+    X = standardized(prepared) if config.get('standardize', False) else prepared['X']
+    return X, prepared['y'], prepared
+
+def servable(model, prepared, config):
+    """
+    The model to log: fitted on standardized features, it is prefixed with
+    a scaler holding the same stats so it still takes raw features
+    """
+    if not config.get('standardize', False):
+        return model
+    scaler = StandardScaler()
+    scaler.mean_ = np.asarray(prepared['mean'])
+    scaler.scale_ = np.asarray(prepared['scale'])
+    scaler.var_ = scaler.scale_ ** 2
+    scaler.n_features_in_ = len(scaler.mean_)
+    scaler.n_samples_seen_ = len(prepared['y'])
+    return make_pipeline(scaler, model)
+
+def train_incremental(config):
+    """
+    Mini-batch training with partial_fit over a memory-mapped dataset
+
+    Batches are sliced from the memory-mapped prepared matrix, so memory
+    is bounded by batch_size rather than dataset size. Batch order is shuffled every
+    epoch; the per-epoch accuracy is progressive validation (each batch
+    is scored before the model learns from it).
+
+    Returns:
+        dict: Response payload with accuracy, SHAP plot and model URI
+    """
+    X, y, prepared = training_matrix(config)
+    classes = prepared['classes']
+    n_samples, n_features = X.shape
+
+    spec = model_specs({'model': config.get('model') or INCREMENTAL_MODEL})[0]
+    model = build_model(spec)
+    if not hasattr(model, 'partial_fit'):
+        raise ValueError(f"{spec['type']} has no partial_fit, pick e.g. SGDClassifier")
+
+    batch_size = int(config.get('batch_size', INCREMENTAL_BATCH_SIZE))
+    epochs = int(config.get('epochs', INCREMENTAL_EPOCHS))
+    rng = np.random.default_rng(config.get('seed'))
+    batch_starts = np.arange(0, n_samples, batch_size)
+
+    def batch(start):
+        return X[start:start + batch_size], y[start:start + batch_size]
+
+    with batched_run() as (run, tracker):
+        tracker.log_params({
+            'model_type': spec['type'],
+            **spec['params'],
+            'mode': 'incremental',
+            'batch_size': batch_size,
+            'epochs': epochs,
+            'features': n_features,
+            'samples': n_samples,
+            'classes': len(classes)
+        })
+
+        acc = 0.0
+        fitted = False
+        for epoch in range(epochs):
+            start_time = time.perf_counter()
+            correct = 0
+            scored = 0
+            for start in rng.permutation(batch_starts):
+                X_batch, y_batch = batch(start)
+                # Score before learning, there is nothing to score until the first update
+                if fitted:
+                    correct += int((model.predict(X_batch) == y_batch).sum())
+                    scored += len(y_batch)
+                model.partial_fit(X_batch, y_batch, classes=classes)
+                fitted = True
+            elapsed = time.perf_counter() - start_time
+            acc = correct / scored if scored else 0.0
+            tracker.log_metrics({
+                "accuracy": acc,
+                "epoch_seconds": elapsed,
+                "samples_per_s": n_samples / elapsed if elapsed else 0.0
+            }, step=epoch)
+
+        tracker.log_model(servable(model, prepared, config), "model")
+        tracker.log_metric("training_samples", n_samples)
+
+        # Explain on a bounded in-memory sample instead of the full matrix
+        X_sample, _ = batch(0)
+        shap_plot, shap_status = log_explanation_and_sample(tracker, model, X_sample, config)
+
+        return {
+            "status": "success",
+            "accuracy": float(acc),
+            "epochs": epochs,
+            "shap_plot": shap_plot,
+            "shap_status": shap_status,
+            "message": "Blue=positive impact, Red=negative impact",
+            "run_id": run.info.run_id,
+            "model_uri": run.info.artifact_uri + "/model"
+        }
+
+def train_cross_validated(config):
+    """
+    k-fold cross-validation of every candidate, optionally refitting the best
+
+    All (candidate, fold) fits run in parallel worker processes over one
+    shared memory-mapped matrix (see models.cross_validate). Each
+    candidate gets a nested run with its per-fold metrics as steps and
+    the mean/std across folds; the parent run records the best one. With
+    ``refit`` the best candidate is fitted on all rows, logged and
+    explained like a regular training run.
+
+    Returns:
+        dict: Response payload with per-candidate CV scores (and model URI if refit)
+    """
+    X, y, prepared = training_matrix(config)
+
+    specs = model_specs(config)
+    cv = config['cv']
+    folds = CV_FOLDS if cv is True else int(cv)
+    if folds < 2:
+        raise ValueError(f"cv needs at least 2 folds, got {folds}")
+    seed = config.get('seed', 0)
+
+    with batched_run() as (run, tracker):
+        tracker.log_params({
+            'mode': 'cross_validation',
+            'cv_folds': folds,
+            'features': X.shape[1],
+            'samples': X.shape[0],
+            'classes': len(prepared['classes']),
+            'standardize': bool(config.get('standardize', False)),
+            'candidates': len(specs)
+        })
+
+        start = time.perf_counter()
+        fold_scores = cross_validate(specs, X, y, folds, seed=seed)
+        cv_seconds = time.perf_counter() - start
+
+        candidates = []
+        for spec, scores in zip(specs, fold_scores):
+            summary = {
+                f"cv_{metric}_{stat}": float(fn([fold[metric] for fold in scores]))
+                for metric in ('accuracy', 'precision', 'recall', 'f1')
+                for stat, fn in (('mean', np.mean), ('std', np.std))
+            }
+            with batched_run(parent_run_id=run.info.run_id) as (child, child_tracker):
+                child_tracker.log_params({'model_type': spec['type'], **spec['params'], 'cv_folds': folds})
+                for i, fold in enumerate(scores):
+                    child_tracker.log_metrics({f"fold_{metric}": value for metric, value in fold.items()}, step=i)
+                child_tracker.log_metrics(summary)
+            candidates.append({
+                "model_type": spec['type'],
+                "params": spec['params'],
+                "folds": scores,
+                **summary,
+                "run_id": child.info.run_id
+            })
+
+        best = max(candidates, key=lambda c: c["cv_accuracy_mean"])
+        tracker.log_params({'best_model_type': best["model_type"], 'best_run_id': best["run_id"]})
+        tracker.log_metrics({
+            "cv_accuracy_mean": best["cv_accuracy_mean"],
+            "cv_accuracy_std": best["cv_accuracy_std"],
+            "cv_f1_mean": best["cv_f1_mean"],
+            "cv_seconds": cv_seconds
+        })
+
+        result = {
+            "status": "success",
+            "accuracy": best["cv_accuracy_mean"],
+            "cv_folds": folds,
+            "cv_seconds": cv_seconds,
+            "run_id": run.info.run_id,
+            "model_uri": None,
+            "candidates": candidates
+        }
+
+        if config.get('refit', False):
+            best_spec = specs[candidates.index(best)]
+            (model, fit_seconds), = fit_candidates([best_spec], X, y)
+            tracker.log_model(servable(model, prepared, config), "model")
+            tracker.log_metrics({"refit_seconds": fit_seconds, "training_samples": len(X)})
+            shap_plot, shap_status = log_explanation_and_sample(tracker, model, X, config)
+            result.update({
+                "model_uri": run.info.artifact_uri + "/model",
+                "shap_plot": shap_plot,
+                "shap_status": shap_status,
+                "message": "Blue=positive impact, Red=negative impact"
             })
-            
+
+        return result
+
+def train_model(config):
+    """
+    Fit, log and explain a model on the NPZ (or .npy store) at config['data_path'],
+    or on in-band config['arrays']
+
+    Models come from the request or config.yaml (see models.model_specs).
+    Several candidates are fitted in parallel processes, logged as nested
+    runs and ranked on a held-out split; the best one is explained.
+    ``incremental`` switches to train_incremental and ``cv`` (a fold
+    count, or true for CV_FOLDS) to train_cross_validated.
+
+    Runs on a job queue worker, so it must not touch the Flask request.
+
+    Returns:
+        dict: Response payload with accuracy, SHAP plot and model URI
+    """
+    if config.get('incremental', False):
+        return train_incremental(config)
+    if config.get('cv'):
+        return train_cross_validated(config)
+
+    X, y, prepared = training_matrix(config)
+    
+    specs = model_specs(config)
+
+    with batched_run() as (run, tracker):
+        # Log parameters
+        tracker.log_params({
+            'features': X.shape[1],
+            'samples': X.shape[0],
+            'classes': len(prepared['classes']),
+            'standardize': bool(config.get('standardize', False)),
+            'candidates': len(specs)
+        })
+
+        if len(specs) == 1:
+            tracker.log_params({'model_type': specs[0]['type'], **specs[0]['params']})
+
             # Train model
-            model = LogisticRegression(max_iter=1000)
-            model.fit(X, y)
-            
+            (model, fit_seconds), = fit_candidates(specs, X, y)
+
             # Log model
-            mlflow.sklearn.log_model(model, "model")
-            
+            tracker.log_model(servable(model, prepared, config), "model")
+            model_uri = run.info.artifact_uri + "/model"
+
             # Log metrics
             acc = model.score(X, y)
-            mlflow.log_metrics({
+            tracker.log_metrics({
                 "accuracy": acc,
-                "training_samples": len(X)
-            })
-            
-            # Generate and log explanation
-            shap_plot_base64, shap_plot_path = create_shap_plot(model, X)
-            mlflow.log_artifact(shap_plot_path, "explanation")
-            
-            # Log sample data
-            sample_path = "/app/data/train_sample.csv"
-            pd.DataFrame(X[:100]).to_csv(sample_path)
-            mlflow.log_artifact(sample_path)
-            
-            return jsonify({
-                "status": "success",
-                "accuracy": float(acc),
-                "shap_plot": f"data:image/png;base64,{shap_plot_base64}",
-                "message": "Blue=positive impact, Red=negative impact",
-                "model_uri": mlflow.active_run().info.artifact_uri + "/model"
+                "training_samples": len(X),
+                "fit_seconds": fit_seconds
             })
-            
+            candidates = []
+        else:
+            # Candidates are compared on a held-out split
+            X_fit, X_val, y_fit, y_val = train_test_split(
+                X, y,
+                test_size=float(config.get('validation_split', VALIDATION_SPLIT)),
+                random_state=config.get('seed', 0)
+            )
+            fitted = fit_candidates(specs, X_fit, y_fit)
+
+            candidates = []
+            for spec, (candidate, fit_seconds) in zip(specs, fitted):
+                with batched_run(parent_run_id=run.info.run_id) as (child, child_tracker):
+                    child_tracker.log_params({'model_type': spec['type'], **spec['params']})
+                    val_acc = candidate.score(X_val, y_val)
+                    child_tracker.log_metrics({
+                        "accuracy": val_acc,
+                        "train_accuracy": candidate.score(X_fit, y_fit),
+                        "training_samples": len(X_fit),
+                        "fit_seconds": fit_seconds
+                    })
+                    child_tracker.log_model(servable(candidate, prepared, config), "model")
+                    candidates.append({
+                        "model_type": spec['type'],
+                        "params": spec['params'],
+                        "accuracy": float(val_acc),
+                        "fit_seconds": fit_seconds,
+                        "run_id": child.info.run_id,
+                        "model_uri": child.info.artifact_uri + "/model",
+                        "model": candidate
+                    })
+
+            best = max(candidates, key=lambda c: c["accuracy"])
+            model, acc, model_uri = best["model"], best["accuracy"], best["model_uri"]
+            tracker.log_params({'best_model_type': best["model_type"], 'best_run_id': best["run_id"]})
+            tracker.log_metrics({"accuracy": acc, "training_samples": len(X_fit)})
+            for candidate in candidates:
+                del candidate["model"]
+        
+        shap_plot, shap_status = log_explanation_and_sample(tracker, model, X, config)
+        
+        return {
+            "status": "success",
+            "accuracy": float(acc),
+            "shap_plot": shap_plot,
+            "shap_status": shap_status,
+            "message": "Blue=positive impact, Red=negative impact",
+            "run_id": run.info.run_id,
+            "model_uri": model_uri,
+            "candidates": candidates
+        }
+
+@app.route('/quick_test', methods=['POST'])
+def quick_test():
+    try:
+        config = training_config(request)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        # Synchronous, but still counts against the pool's concurrency cap
+        _, future = job_queue.submit(train_model, config)
+        return jsonify(future.result())
+    except queue.Full as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/train', methods=['POST'])
+def train():
+    try:
+        config = training_config(request)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if 'data_path' not in config and 'arrays' not in config:
+        return jsonify({"status": "error", "message": "Missing required field: data_path"}), 400
+    try:
+        job_id, _ = job_queue.submit(train_model, config)
+    except queue.Full as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    return jsonify({"status": "queued", "job_id": job_id}), 202
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(feature_cache.stats())
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.status(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job: {job_id}"}), 404
+    return jsonify(job)
+
+@app.route('/jobs', methods=['GET'])
+def jobs_overview():
+    return jsonify(job_queue.stats())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,169 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from common.disk_cache import DiskLRUCache
+from common.labels import encode_labels
+
+# Part of every entry key, bump when what an entry holds changes
+# (2: labels are kept as stored instead of multiplied by 4)
+ENTRY_VERSION = 2
+
+# Samples flattened and converted per step while building a matrix
+PREPARE_CHUNK_SIZE = 8192
+
+
+def _standardization(total, total_sq, n_samples):
+    # Zero-variance features keep scale 1, as StandardScaler does
+    mean = total / max(n_samples, 1)
+    scale = np.sqrt(np.maximum(total_sq / max(n_samples, 1) - mean ** 2, 0.0))
+    scale[scale == 0] = 1.0
+    return mean, scale
+
+
+def prepare_in_memory(images, labels):
+    """
+    Prepared matrix for arrays that aren't on disk (e.g. sent in-band)
+
+    Returns:
+        dict: 'X' (C-contiguous float32, one row per sample), 'y' (class
+        codes), 'mean' and 'scale' (float64 per feature), 'classes'
+    """
+    X = np.ascontiguousarray(np.asarray(images).reshape(len(images), -1), dtype=np.float32)
+    y = encode_labels(labels)
+    mean, scale = _standardization(
+        X.sum(axis=0, dtype=np.float64), np.square(X, dtype=np.float64).sum(axis=0), len(X)
+    )
+    return {'X': X, 'y': y, 'mean': mean, 'scale': scale, 'classes': np.unique(y), 'path': None, 'key': None}
+
+
+def standardized(prepared):
+    """(X - mean) / scale as float32, built once per cached matrix and memory-mapped after"""
+    if prepared['path'] is None:
+        return ((prepared['X'] - prepared['mean']) / prepared['scale']).astype(np.float32)
+    return feature_cache.standardized(prepared)
+
+
+class FeatureCache(DiskLRUCache):
+    """
+    On-disk LRU cache of prepared training matrices, bounded by total bytes
+
+    Each entry is a directory named after the input's content digest
+    holding X.npy (flattened C-contiguous float32), y.npy (class codes),
+    mean.npy and scale.npy (standardization stats), and Xs.npy once a
+    standardized copy is asked for. Everything is opened with
+    mmap_mode='r', so requests and model types share the page cache
+    instead of re-loading, re-flattening and re-converting the input.
+    """
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _entry_exists(self, key):
+        # meta.json is written last, an entry without it is incomplete
+        return os.path.exists(os.path.join(self._entry_path(key), 'meta.json'))
+
+    def _remove_entry(self, key):
+        # Open memmaps of an evicted entry stay valid until closed
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def _open(self, key):
+        path = self._entry_path(key)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        prepared = {
+            name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            for name in ('X', 'y', 'mean', 'scale')
+        }
+        prepared.update(classes=np.array(meta['classes']), path=path, key=key)
+        return prepared
+
+    def _build(self, path, images, labels, chunk_size):
+        # Flatten and convert chunk by chunk, accumulating the stats on the way
+        n_samples = len(images)
+        n_features = int(np.prod(images.shape[1:]))
+        os.makedirs(path)
+        X = np.lib.format.open_memmap(
+            os.path.join(path, 'X.npy'), mode='w+', dtype=np.float32, shape=(n_samples, n_features)
+        )
+        total = np.zeros(n_features)
+        total_sq = np.zeros(n_features)
+        for start in range(0, n_samples, chunk_size):
+            rows = np.asarray(images[start:start + chunk_size]).reshape(-1, n_features)
+            X[start:start + len(rows)] = rows
+            rows = X[start:start + len(rows)].astype(np.float64)
+            total += rows.sum(axis=0)
+            total_sq += np.square(rows).sum(axis=0)
+        X.flush()
+        del X
+
+        y = encode_labels(labels)
+        mean, scale = _standardization(total, total_sq, n_samples)
+        np.save(os.path.join(path, 'y.npy'), y)
+        np.save(os.path.join(path, 'mean.npy'), mean)
+        np.save(os.path.join(path, 'scale.npy'), scale)
+        # Written last, marks the entry complete
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'samples': n_samples, 'features': n_features, 'classes': np.unique(y).tolist()}, f)
+
+    def _size(self, key):
+        path = self._entry_path(key)
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def prepared(self, key, arrays, chunk_size=PREPARE_CHUNK_SIZE):
+        """
+        Prepared matrix for the dataset with content digest key
+
+        Built from arrays['images'] and arrays['labels'] on a miss.
+
+        Returns:
+            dict: As prepare_in_memory, with memmaps and the entry's path
+        """
+        key = f'{key}.v{ENTRY_VERSION}'
+        if self._touch(key) is not None:
+            try:
+                prepared = self._open(key)
+                self._count(hit=True)
+                return prepared
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                pass
+
+        self._count(hit=False)
+        tmp = f"{self._entry_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self._build(tmp, arrays['images'], arrays['labels'], chunk_size)
+            try:
+                os.replace(tmp, self._entry_path(key))
+            except OSError:
+                # Another writer finished the same entry first
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self._record(key, {'bytes': self._size(key)}, keep_newest=True)
+        return self._open(key)
+
+    def standardized(self, prepared, chunk_size=PREPARE_CHUNK_SIZE):
+        """Memory-mapped Xs.npy of an entry, written on first use"""
+        path = os.path.join(prepared['path'], 'Xs.npy')
+        if not os.path.exists(path):
+            X, mean, scale = prepared['X'], prepared['mean'], prepared['scale']
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            Xs = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=X.shape)
+            for start in range(0, len(X), chunk_size):
+                Xs[start:start + chunk_size] = (X[start:start + chunk_size] - mean) / scale
+            Xs.flush()
+            del Xs
+            os.replace(tmp, path)
+            self._record(prepared['key'], {'bytes': self._size(prepared['key'])}, keep_newest=True)
+        return np.load(path, mmap_mode='r')
+
+
+feature_cache = FeatureCache(
+    cache_dir=os.getenv('TRAINER_FEATURE_CACHE_DIR', '/app/data/feature_cache'),
+    max_bytes=int(os.getenv('TRAINER_FEATURE_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+)
@@ -0,0 +1,62 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.job_history import JobHistory
+
+
+class JobQueue:
+    """
+    Bounded pool for training jobs
+
+    At most ``workers`` jobs run at once and at most ``max_pending`` more
+    may wait; beyond that ``submit`` raises ``queue.Full``. Job status
+    moves pending -> running -> done/failed and the value the job function
+    returns is kept as its result.
+    """
+
+    def __init__(self, workers, max_pending=16, max_history=1000):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='train')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._history = JobHistory(max_history)
+
+    def _run(self, job_id, fn, args):
+        self._history.set(job_id, status='running', started_at=time.time())
+        try:
+            result = fn(*args)
+            self._history.set(job_id, status='done', result=result, finished_at=time.time())
+            return result
+        except Exception as e:
+            self._history.set(job_id, status='failed', error=str(e), finished_at=time.time())
+            raise
+        finally:
+            self._slots.release()
+
+    def submit(self, fn, *args):
+        """
+        Schedule fn(*args) on the pool
+
+        Returns:
+            tuple: (job id, concurrent.futures.Future)
+        """
+        if not self._slots.acquire(blocking=False):
+            raise queue.Full('Training queue is full')
+
+        job_id = self._history.add(status='pending', submitted_at=time.time())
+        return job_id, self._pool.submit(self._run, job_id, fn, args)
+
+    def status(self, job_id):
+        """Return a copy of the job record, None for unknown ids"""
+        return self._history.status(job_id)
+
+    def stats(self):
+        return {'workers': self.workers, 'jobs': self._history.counts()}
+
+
+job_queue = JobQueue(
+    workers=int(os.getenv('TRAINER_WORKERS', os.cpu_count() or 1)),
+    max_pending=int(os.getenv('TRAINER_MAX_PENDING', 16))
+)
@@ -0,0 +1,186 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import yaml
+from joblib import Parallel, delayed
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+from sklearn.model_selection import KFold, StratifiedKFold
+from sklearn.linear_model import (
+    LogisticRegression,
+    SGDClassifier,
+    Perceptron,
+    PassiveAggressiveClassifier
+)
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import (
+    RandomForestClassifier,
+    ExtraTreesClassifier,
+    GradientBoostingClassifier
+)
+
+# Shared project config, mounted into the container by docker-compose
+CONFIG_PATH = os.getenv("TRAINER_CONFIG", "/app/config.yaml")
+
+# Estimators that can be requested by name
+MODEL_ZOO = {
+    'LogisticRegression': LogisticRegression,
+    'SGDClassifier': SGDClassifier,
+    'Perceptron': Perceptron,
+    'PassiveAggressiveClassifier': PassiveAggressiveClassifier,
+    'DecisionTreeClassifier': DecisionTreeClassifier,
+    'RandomForestClassifier': RandomForestClassifier,
+    'ExtraTreesClassifier': ExtraTreesClassifier,
+    'GradientBoostingClassifier': GradientBoostingClassifier
+}
+
+# Used when neither the request nor config.yaml names a model
+DEFAULT_MODEL = {'type': 'LogisticRegression', 'params': {'max_iter': 1000}}
+
+# Scratch space for the matrix cross-validation workers memory-map
+CV_SCRATCH_DIR = os.getenv("TRAINER_SCRATCH_DIR", tempfile.gettempdir())
+
+
+def load_model_config():
+    """Return the model section of config.yaml, empty if the file is missing"""
+    try:
+        with open(CONFIG_PATH) as f:
+            return (yaml.safe_load(f) or {}).get('model') or {}
+    except FileNotFoundError:
+        return {}
+
+
+def model_specs(config):
+    """
+    Resolve the candidate models for a training request
+
+    The request's ``candidates`` list or ``model`` entry wins, then the
+    ``model`` section of config.yaml (which may hold its own
+    ``candidates``), then DEFAULT_MODEL.
+
+    Returns:
+        list: {'type': name, 'params': dict} per candidate
+    """
+    model_config = config.get('model') or load_model_config() or DEFAULT_MODEL
+    candidates = config.get('candidates') or model_config.get('candidates') or [model_config]
+
+    specs = []
+    for candidate in candidates:
+        if candidate.get('type') not in MODEL_ZOO:
+            raise ValueError(f"Unknown model type: {candidate.get('type')}. Available: {sorted(MODEL_ZOO)}")
+        specs.append({'type': candidate['type'], 'params': dict(candidate.get('params') or {})})
+    return specs
+
+
+def build_model(spec):
+    """Instantiate an unfitted estimator from a spec"""
+    return MODEL_ZOO[spec['type']](**spec['params'])
+
+
+def fit_candidate(spec, X, y):
+    """Fit one candidate, runs inside a worker process"""
+    start = time.perf_counter()
+    model = build_model(spec).fit(X, y)
+    return model, time.perf_counter() - start
+
+
+def _cores_per_fit(spec, cores):
+    # n_jobs=-1 (or None for single-threaded models) follows sklearn's meaning
+    n_jobs = spec['params'].get('n_jobs') or 1
+    return cores if n_jobs < 0 else min(n_jobs, cores)
+
+
+def fit_candidates(specs, X, y, cores=None):
+    """
+    Fit every candidate, in parallel worker processes when there are several
+
+    Each candidate keeps its own ``n_jobs``, and the number of candidates
+    fitted at once is chosen so the total stays within ``cores``. joblib
+    memory-maps large arrays, so workers share X instead of copying it.
+
+    Returns:
+        list: (fitted model, fit seconds) per spec, in order
+    """
+    if len(specs) == 1:
+        return [fit_candidate(specs[0], X, y)]
+
+    cores = cores or os.cpu_count() or 1
+    widest = max(_cores_per_fit(spec, cores) for spec in specs)
+    parallel = max(1, min(len(specs), cores // widest))
+    return Parallel(n_jobs=parallel, backend='loky')(
+        delayed(fit_candidate)(spec, X, y) for spec in specs
+    )
+
+
+def fold_indices(y, folds, seed=0):
+    """
+    Train/test row indices for k-fold cross-validation
+
+    Folds are stratified when every class has at least ``folds`` samples,
+    plain shuffled k-fold otherwise.
+
+    Returns:
+        list: (train_idx, test_idx) per fold
+    """
+    _, counts = np.unique(y, return_counts=True)
+    if counts.min() >= folds:
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    else:
+        splitter = KFold(n_splits=folds, shuffle=True, random_state=seed)
+    return list(splitter.split(np.zeros(len(y)), y))
+
+
+def score_fold(spec, X, y, train_idx, test_idx):
+    """Fit on one fold's training rows and score its held-out rows, runs inside a worker process"""
+    start = time.perf_counter()
+    model = build_model(spec).fit(X[train_idx], y[train_idx])
+    fit_seconds = time.perf_counter() - start
+    y_pred = model.predict(X[test_idx])
+    y_true = y[test_idx]
+    return {
+        'accuracy': accuracy_score(y_true, y_pred),
+        'precision': precision_score(y_true, y_pred, average='weighted', zero_division=0),
+        'recall': recall_score(y_true, y_pred, average='weighted', zero_division=0),
+        'f1': f1_score(y_true, y_pred, average='weighted', zero_division=0),
+        'fit_seconds': fit_seconds
+    }
+
+
+def cross_validate(specs, X, y, folds, cores=None, seed=0):
+    """
+    k-fold cross-validate every candidate, all (candidate, fold) fits in parallel
+
+    X is written once to a memory-mapped .npy (unless it already is a
+    memmap) and workers receive only that file and their fold's row
+    indices, so no per-fold copy of the matrix is pickled. Concurrency
+    follows fit_candidates: each fit keeps its ``n_jobs`` within ``cores``.
+
+    Returns:
+        list: Per spec, the list of fold metric dicts (see score_fold)
+    """
+    splits = fold_indices(y, folds, seed)
+    tasks = [(spec, train_idx, test_idx) for spec in specs for train_idx, test_idx in splits]
+
+    cores = cores or os.cpu_count() or 1
+    widest = max(_cores_per_fit(spec, cores) for spec in specs)
+    parallel = max(1, min(len(tasks), cores // widest))
+
+    scratch = None
+    if not isinstance(X, np.memmap):
+        scratch = tempfile.mkdtemp(prefix='cv-', dir=CV_SCRATCH_DIR)
+        path = os.path.join(scratch, 'X.npy')
+        np.save(path, np.ascontiguousarray(X))
+        X = np.load(path, mmap_mode='r')
+    try:
+        # joblib pickles a memmap as its file name and offset, not its contents
+        scores = Parallel(n_jobs=parallel, backend='loky')(
+            delayed(score_fold)(spec, X, y, train_idx, test_idx) for spec, train_idx, test_idx in tasks
+        )
+    finally:
+        del X
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    return [scores[i:i + folds] for i in range(0, len(scores), folds)]
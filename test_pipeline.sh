@@ -8,21 +8,11 @@ echo "✅ Data loaded at: $DATA_PATH"
 
 # 2. Convert CSV to NPZ format
 echo "Step 2/5: Converting to NPZ format..."
-docker-compose exec augmenter python -c "
-import numpy as np
-import pandas as pd
-try:
-    df = pd.read_csv('/app/data/hyperk_sample.csv')
-    # Ensure labels are integers (0-4) for classification
-    labels = (df['target'].values * 4).astype(int)  
-    np.savez('/app/data/hyperk_sample.npz',
-             images=df.drop('target',axis=1).values.reshape(-1, 20, 1),
-             labels=labels)
-    print('✅ Conversion successful. Unique labels:', np.unique(labels))
-except Exception as e:
-    print('❌ Conversion failed:', str(e))
-    exit(1)
-" || exit 1
+docker-compose exec augmenter python -m common.convert \
+  --input /app/data/hyperk_sample.csv \
+  --output /app/data/hyperk_sample.npz \
+  --shape 20,1 \
+  --label-scale 4 || exit 1
 
 # 3. Apply PuzzleMix augmentation
 echo "Step 3/5: Applying PuzzleMix augmentation..."